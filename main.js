@@ -19,6 +19,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- State Management ---
     let debounceTimer;
     let localCompanyList = [];
+    let logoThumbnails = {};
     let selectedCountry = null;
 
     // --- JSON Loading ---
@@ -39,9 +40,25 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Local thumbnails written by scripts/prefetch_logos.py, keyed by logo URL and by QID
+    async function loadLogoManifest() {
+        try {
+            const response = await fetch('data/logos/manifest.json');
+            if (!response.ok) return;
+            const manifest = await response.json();
+            Object.entries(manifest.logos || {}).forEach(([qid, logo]) => {
+                logoThumbnails[logo.source] = logo.thumbnail;
+                logoThumbnails[qid] = logo.thumbnail;
+            });
+        } catch (error) {
+            console.warn('No local logo thumbnails, falling back to Commons:', error);
+        }
+    }
+
     // --- Initial Setup ---
     updateFavicon('default');
     loadCompaniesFromJSON();
+    loadLogoManifest();
     // No dynamic title update yet, just original h1 content
 
 
@@ -541,7 +558,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 link.target = '_blank';
                 if (/\.(jpg|jpeg|png|gif|svg)$/i.test(dataValue)) {
                     const img = document.createElement('img');
-                    img.src = dataValue;
+                    const qid = key === 'LOGO_IMAGE' && result.WIKIDATA ? result.WIKIDATA.value.split('/').pop() : null;
+                    img.src = logoThumbnails[dataValue] || (qid && logoThumbnails[qid]) || dataValue;
                     img.style.maxWidth = '200px';
                     img.style.maxHeight = '200px';
                     link.appendChild(img);
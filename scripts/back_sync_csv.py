@@ -1,37 +1,67 @@
 import pandas as pd
-import json
 import os
 
+from company_store import JSON_PATH, JSONL_PATH, iter_companies
+from csv_patch import apply_diff, cell_diff, load_csv
+from identity_index import resolve_frame
+
 CSV_PATH = 'data/companies.csv'
-JSON_PATH = 'data/companies.json'
+
+def reconcile(df, companies):
+    """
+    Keyed merge-join of the CSV rows with the JSON entries (QID, TAX ID, Wikipedia URL, name).
+    Returns the patched CSV frame, the cell diff JSON -> CSV (Wikidata column, applied) and
+    the cell diff CSV -> JSON (label, picked up by the next sync_anagrafica run), plus key conflicts.
+    Rows matched on their QID skip the other keys; the rest (matched on TAX ID, Wikipedia URL
+    or name, or unmatched) are checked for conflicts on every key.
+    """
+    match, conflicts = resolve_frame(df, companies, check_conflicts=False)
+    matched = match.notna().to_numpy()
+    positions = match[matched].to_numpy(dtype=int)
+
+    after = df.copy()
+    after.loc[matched, 'Wikidata'] = companies['id'].to_numpy(dtype=object)[positions]
+    to_csv = cell_diff(df, after)
+
+    # First CSV row per JSON entry, as sync_anagrafica keeps the first duplicate
+    pairs = pd.DataFrame({'position': positions, 'COMPANY': df.loc[matched, 'COMPANY'].str.strip().to_numpy()})
+    pairs = pairs.drop_duplicates('position')
+    current = companies.iloc[pairs['position']][['label']].reset_index(drop=True)
+    incoming = pd.DataFrame({'label': pairs['COMPANY'].to_numpy()})
+    to_json = cell_diff(current, incoming, label_column='label')
+    to_json['row'] = pairs['position'].to_numpy()[to_json['row'].to_numpy(dtype=int)]
+
+    return after, to_csv, to_json, conflicts
 
 def back_sync_csv():
-    if not os.path.exists(JSON_PATH) or not os.path.exists(CSV_PATH):
+    if not (os.path.exists(JSONL_PATH) or os.path.exists(JSON_PATH)) or not os.path.exists(CSV_PATH):
+        return
+
+    # Stream clean JSON (JSONL store if present) into columns
+    companies = pd.DataFrame(list(iter_companies()), columns=['id', 'label']).fillna('')
+    companies = companies[companies['id'] != ''].reset_index(drop=True)
+
+    df = load_csv(CSV_PATH)
+    after, to_csv, to_json, conflicts = reconcile(df, companies)
+
+    for c in conflicts:
+        if c['chosen'] is None:
+            print(f"  CONFLICT [{c['key']}={c['value']}]: CSV row '{df.at[c['row'], 'COMPANY']}' "
+                  f"({df.at[c['row'], 'Wikidata']}) not matched to '{companies.at[c['other'], 'label']}' "
+                  f"({companies.at[c['other'], 'id']}): different QID")
+            continue
+        print(f"  CONFLICT [{c['key']}={c['value']}]: CSV row '{df.at[c['row'], 'COMPANY']}' "
+              f"matches '{companies.at[c['chosen'], 'label']}' and '{companies.at[c['other'], 'label']}'")
+    for change in to_json.to_dict('records'):
+        print(f"  Pending for next sync: JSON {change['old']!r} -> {change['new']!r}")
+
+    if to_csv.empty:
+        print(f"{CSV_PATH} already in sync, nothing written.")
         return
 
-    # Load clean JSON
-    with open(JSON_PATH, 'r') as f:
-        json_data = json.load(f)
-    
-    label_to_id = {item['label']: item['id'] for item in json_data if item['id']}
-
-    # Load CSV
-    df = pd.read_csv(CSV_PATH)
-
-    # Update Wikidata column based on Label matching
-    count = 0
-    for index, row in df.iterrows():
-        name = str(row['COMPANY']).strip()
-        if name in label_to_id:
-            new_id = label_to_id[name]
-            old_id = str(row.get('Wikidata', ''))
-            if old_id != new_id:
-                df.at[index, 'Wikidata'] = new_id
-                count += 1
-    
-    # Save CSV
-    df.to_csv(CSV_PATH, index=False)
-    print(f"Back-synced {count} IDs to {CSV_PATH}")
+    # Only the changed rows are rewritten; the patch log records every changed cell
+    rows = apply_diff(CSV_PATH, df, after, to_csv, source='back_sync_csv')
+    print(f"Back-synced {len(to_csv)} IDs to {CSV_PATH} ({rows} rows rewritten)")
 
 if __name__ == "__main__":
     back_sync_csv()
@@ -0,0 +1,115 @@
+import json
+import os
+import re
+import stat
+import tempfile
+from contextlib import contextmanager
+
+JSON_PATH = 'data/companies.json'
+JSONL_PATH = 'data/companies.jsonl'
+
+READ_CHUNK = 1 << 16
+SEPARATOR = re.compile(r'[\s,]*')
+
+def label_key(item):
+    # The id breaks ties, so the order never depends on the input order
+    return (item['label'].lower(), item.get('id') or '')
+
+@contextmanager
+def atomic_write(path):
+    """
+    Write to a temporary file next to `path` and move it into place only once
+    the write succeeded, so a crash never leaves a half-written file behind.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates 0600 files: keep the mode of the file being replaced
+        os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode) if os.path.exists(path) else 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def iter_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def iter_json_array(path):
+    """
+    Stream the objects of a top-level JSON array without loading the whole file.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = f.read(READ_CHUNK)
+        pos = SEPARATOR.match(buffer).end()
+        if pos == len(buffer):
+            return
+        if buffer[pos] != '[':
+            raise json.JSONDecodeError("Expected a JSON array", buffer, pos)
+        pos += 1
+        eof = False
+        while True:
+            pos = SEPARATOR.match(buffer, pos).end()
+            if buffer.startswith(']', pos):
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(READ_CHUNK)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+
+def iter_companies(path=None):
+    """
+    Stream company entries from the JSONL store, falling back to the JSON array export.
+    """
+    if path is None:
+        path = JSONL_PATH if os.path.exists(JSONL_PATH) else JSON_PATH
+    if path.endswith('.jsonl'):
+        return iter_jsonl(path)
+    return iter_json_array(path)
+
+def write_jsonl(path, records):
+    count = 0
+    with atomic_write(path) as f:
+        for item in records:
+            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+def write_json_array(path, records):
+    """
+    Stream records as an indented JSON array, byte-identical to json.dump(indent=2).
+    """
+    count = 0
+    with atomic_write(path) as f:
+        for item in records:
+            f.write('[\n  ' if count == 0 else ',\n  ')
+            f.write(json.dumps(item, indent=2, ensure_ascii=False).replace('\n', '\n  '))
+            count += 1
+        f.write('\n]' if count else '[]')
+    return count
+
+def save_companies(records, jsonl_path=JSONL_PATH, json_path=JSON_PATH):
+    """
+    Sort by label, store as JSONL and export the indented JSON array read by the frontend.
+    The sync holds every record in memory anyway (merge, validation), so the sort is an
+    in-memory sorted(); only the file writes are streamed. Both files are replaced atomically.
+    """
+    count = write_jsonl(jsonl_path, sorted(records, key=label_key))
+    write_json_array(json_path, iter_jsonl(jsonl_path))
+    return count
@@ -0,0 +1,55 @@
+def normalize_country(name):
+    """
+    Unify country names (e.g., China, People's Republic of China, Cina -> China).
+    """
+    if not name or str(name).lower() == 'nan':
+        return "Unknown"
+    
+    name_clean = name.strip().lower()
+    
+    # China normalization
+    china_variants = ["china", "people's republic of china", "cina", "prc"]
+    if any(v == name_clean for v in china_variants) or "people's republic of china" in name_clean:
+        return "China"
+    
+    # USA normalization
+    usa_variants = ["united states", "usa", "united states of america", "u.s.a.", "u.s."]
+    if any(v == name_clean for v in usa_variants) or "united states of america" in name_clean:
+        return "United States"
+
+    # UK normalization
+    uk_variants = ["united kingdom", "uk", "u.k.", "great britain"]
+    if any(v == name_clean for v in uk_variants):
+        return "United Kingdom"
+
+    # Czechia normalization
+    czech_variants = ["czech republic", "czechia", "czech rep."]
+    if any(v == name_clean for v in czech_variants):
+        return "Czechia"
+    
+    # Taiwan normalization
+    taiwan_variants = ["taiwan", "republic of china", "taiwan, province of china"]
+    if any(v == name_clean for v in taiwan_variants):
+        return "Taiwan"
+
+    # Netherlands normalization
+    netherlands_variants = ["netherlands", "the netherlands", "kingdom of the netherlands"]
+    if any(v == name_clean for v in netherlands_variants):
+        return "Netherlands"
+
+    # UK normalization
+    uk_variants = ["united kingdom", "uk", "u.k.", "great britain"]
+    if any(v == name_clean for v in uk_variants):
+        return "United Kingdom"
+
+    # South Korea normalization
+    skorea_variants = ["south korea", "republic of korea", "korea, south", "korea (republic of)"]
+    if any(v == name_clean for v in skorea_variants):
+        return "South Korea"
+
+    # Russia normalization
+    russia_variants = ["russia", "russian federation"]
+    if any(v == name_clean for v in russia_variants):
+        return "Russia"
+        
+    return name.strip().title() # title() ensures 'France', not 'france' or 'FRANCE'
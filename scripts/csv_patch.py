@@ -0,0 +1,123 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from company_store import atomic_write
+
+PATCH_LOG_PATH = 'data/csv_patches.jsonl'
+
+def load_csv(path):
+    """
+    Read a CSV with every cell as the literal string in the file (no NaN/float coercion),
+    so unchanged cells compare equal to what is on disk.
+    """
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+def cell_diff(before, after, label_column='COMPANY'):
+    """
+    Cell-level diff between two frames with the same index and columns.
+    Returns one row per changed cell: row, company, column, old, new.
+    """
+    after = after.reindex(index=before.index, columns=before.columns)
+    old = before.to_numpy(dtype=object)
+    new = after.to_numpy(dtype=object)
+    rows, cols = np.nonzero(old != new)
+    labels = before[label_column].to_numpy(dtype=object)[rows] if label_column in before.columns else [''] * len(rows)
+    return pd.DataFrame({
+        'row': before.index.to_numpy()[rows],
+        'company': labels,
+        'column': before.columns.to_numpy()[cols],
+        'old': old[rows, cols],
+        'new': new[rows, cols],
+    })
+
+def _raw_records(text):
+    """
+    Split CSV text into (raw text, fields) records, keeping each record's exact original bytes
+    (a quoted field may span several physical lines). Empty and whitespace-only lines,
+    which pandas skips, are kept as passthrough records with fields=None.
+    """
+    lines = text.splitlines(keepends=True)
+    reader = csv.reader(lines)
+    records = []
+    start = 0
+    for fields in reader:
+        end = reader.line_num
+        raw = ''.join(lines[start:end])
+        records.append((raw, fields if raw.strip() else None))
+        start = end
+    return records
+
+def _format_record(values, newline):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator=newline).writerow(values)
+    return buffer.getvalue()
+
+def patch_csv(path, before, after, rows):
+    """
+    Rewrite only the records at `rows` (positions in `before`/`after`) with their new values;
+    every other record, blank lines included, keeps its original bytes. The file is replaced
+    atomically. If the file's records do not line up with `before`, the whole file is
+    rewritten from `after` instead.
+    """
+    rows = sorted(set(int(r) for r in rows))
+    if not rows:
+        return 0
+
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        text = f.read()
+    records = _raw_records(text)
+    newline = '\r\n' if records and records[0][0].endswith('\r\n') else '\n'
+
+    # records[data[0]] is the header, records[data[r + 1]] is row r
+    data = [i for i, (raw, fields) in enumerate(records) if fields is not None]
+    old = before.to_numpy(dtype=object)
+    aligned = len(data) == len(before) + 1 and all(records[data[r + 1]][1] == list(old[r]) for r in rows)
+    if not aligned:
+        print(f"  [!] {path} records do not line up with the loaded rows, rewriting the whole file.")
+        with atomic_write(path) as f:
+            f.write(_format_record(after.columns, newline))
+            for values in after.to_numpy(dtype=object):
+                f.write(_format_record(values, newline))
+        return len(rows)
+
+    values = after.to_numpy(dtype=object)
+    raws = [raw for raw, fields in records]
+    for r in rows:
+        record = _format_record(values[r], newline)
+        original = raws[data[r + 1]]
+        if not original.endswith(('\n', '\r')):
+            record = record[:-len(newline)]
+        raws[data[r + 1]] = record
+
+    with atomic_write(path) as f:
+        f.write(''.join(raws))
+    return len(rows)
+
+def log_patch(diff, source, log_path=PATCH_LOG_PATH):
+    """
+    Append the changed cells to the JSONL patch log, one line per cell.
+    """
+    if diff.empty:
+        return
+    timestamp = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    with open(log_path, 'a', encoding='utf-8') as f:
+        for change in diff.to_dict('records'):
+            entry = {'time': timestamp, 'source': source}
+            entry.update({k: (int(v) if k == 'row' else v) for k, v in change.items()})
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+def apply_diff(path, before, after, diff, source):
+    """
+    Write `diff` (from cell_diff(before, after)) to the CSV at `path` (changed rows only)
+    and the patch log. Nothing is written when the diff is empty. Returns the number of rewritten rows.
+    """
+    if diff.empty:
+        return 0
+    count = patch_csv(path, before, after, diff['row'].unique())
+    log_patch(diff, source)
+    return count
@@ -1,14 +1,38 @@
 import requests
 import json
+import re
 import sys
 
+from label_cache import LabelCache
+import wdqs
+
+ENTITY_PREFIX = "http://www.wikidata.org/entity/"
+
+# Fields returned as raw QIDs by the queries below; their labels are resolved
+# afterwards through the shared LabelCache instead of an rdfs:label join per company.
+ENTITY_FIELDS = [
+    'COUNTRY_label', 'LEGAL_FORM', 'NAMED_AFTER', 'REPLACES', 'REPLACED_BY',
+    'SECTORS', 'HEADQUARTERS', 'FOUNDED_BY',
+    'CEOS_HISTORY', 'OWNERS_HISTORY', 'BOARD_MEMBERS',
+    'PARENT_ORGANIZATIONS', 'SUBSIDIARIES', 'PRODUCTS_SERVICES',
+    'STOCK_EXCHANGES', 'BRANDS_OWNED', 'PARENT_BRANDS'
+]
+QID_TOKEN = re.compile(r'\bQ\d+\b')
+
+def qid(var):
+    """
+    SPARQL expression turning the entity in ?var into its bare QID.
+    """
+    return f'STRAFTER(STR(?{var}), "{ENTITY_PREFIX}")'
+
 def get_sparql_results(query):
     url = 'https://query.wikidata.org/sparql'
     headers = {
         'Accept': 'application/sparql-results+json',
         'User-Agent': 'WikidataInspector/1.0 (https://github.com/nelsonmau/Manintheloop)'
     }
-    response = requests.get(url, params={'query': query}, headers=headers)
+    with wdqs.slot():
+        response = requests.get(url, params={'query': query}, headers=headers)
     if response.status_code == 200:
         return response.json()
     else:
@@ -20,66 +44,61 @@ def get_core_info_query(wikidata_id):
     return f"""SELECT ?WIKIDATA
         (SAMPLE(?COMPANY_label) AS ?COMPANY_label)
         (SAMPLE(?description) AS ?DESCRIPTION)
-        (SAMPLE(?COUNTRY_label) AS ?COUNTRY_label)
+        (SAMPLE({qid("COUNTRY")}) AS ?COUNTRY_label)
         (SAMPLE(?wikipedia_url) AS ?WIKIPEDIA_URL)
         (SAMPLE(?inception_date) AS ?INCEPTION_DATE)
-        (SAMPLE(?legal_form_label) AS ?LEGAL_FORM)
-        (SAMPLE(?named_after_label) AS ?NAMED_AFTER)
+        (SAMPLE({qid("legal_form")}) AS ?LEGAL_FORM)
+        (SAMPLE({qid("named_after")}) AS ?NAMED_AFTER)
         (SAMPLE(?slogan) AS ?SLOGAN)
         (SAMPLE(?employees_count) AS ?EMPLOYEES_COUNT)
-        (SAMPLE(?replaces_label) AS ?REPLACES)
-        (SAMPLE(?replaced_by_label) AS ?REPLACED_BY)
+        (SAMPLE({qid("replaces")}) AS ?REPLACES)
+        (SAMPLE({qid("replaced_by")}) AS ?REPLACED_BY)
         (SAMPLE(?lei) AS ?LEGAL_ENTITY_IDENTIFIER)
-        (GROUP_CONCAT(DISTINCT ?SECTOR_label; separator=", ") AS ?SECTORS)
-        (GROUP_CONCAT(DISTINCT ?HEADQUARTERS_label; separator=", ") AS ?HEADQUARTERS)
-        (GROUP_CONCAT(DISTINCT ?founder_label; separator=", ") AS ?FOUNDED_BY)
+        (GROUP_CONCAT(DISTINCT {qid("SECTOR")}; separator=", ") AS ?SECTORS)
+        (GROUP_CONCAT(DISTINCT {qid("HEADQUARTERS")}; separator=", ") AS ?HEADQUARTERS)
+        (GROUP_CONCAT(DISTINCT {qid("founder")}; separator=", ") AS ?FOUNDED_BY)
         WHERE {{
             VALUES ?WIKIDATA {{ wd:{wikidata_id} }}
             ?WIKIDATA rdfs:label ?COMPANY_label. FILTER(LANG(?COMPANY_label) = "en")
 
             OPTIONAL {{?WIKIDATA schema:description ?description. FILTER(LANG(?description) = "en")}}
-            OPTIONAL {{
-                ?WIKIDATA wdt:P17 ?COUNTRY.
-                ?COUNTRY rdfs:label ?COUNTRY_label. FILTER(LANG(?COUNTRY_label) = "en")
-            }}
+            OPTIONAL {{?WIKIDATA wdt:P17 ?COUNTRY.}}
             OPTIONAL {{?WIKIDATA wdt:P571 ?inception_date.}}
             OPTIONAL {{?wikipedia_url schema:about ?WIKIDATA; schema:inLanguage "en"; schema:isPartOf <https://en.wikipedia.org/>.}}
-            OPTIONAL {{?WIKIDATA wdt:P452 ?SECTOR. ?SECTOR rdfs:label ?SECTOR_label. FILTER(LANG(?SECTOR_label) = "en")}}
-            OPTIONAL {{?WIKIDATA wdt:P159 ?HEADQUARTERS. ?HEADQUARTERS rdfs:label ?HEADQUARTERS_label. FILTER(LANG(?HEADQUARTERS_label) = "en")}}
-            OPTIONAL {{?WIKIDATA wdt:P1454 ?legal_form. ?legal_form rdfs:label ?legal_form_label. FILTER(LANG(?legal_form_label) = "en")}}
-            OPTIONAL {{?WIKIDATA wdt:P112 ?founder. ?founder rdfs:label ?founder_label. FILTER(LANG(?founder_label) = "en")}}
-            OPTIONAL {{?WIKIDATA wdt:P138 ?named_after. ?named_after rdfs:label ?named_after_label. FILTER(LANG(?named_after_label) = "en")}}
+            OPTIONAL {{?WIKIDATA wdt:P452 ?SECTOR.}}
+            OPTIONAL {{?WIKIDATA wdt:P159 ?HEADQUARTERS.}}
+            OPTIONAL {{?WIKIDATA wdt:P1454 ?legal_form.}}
+            OPTIONAL {{?WIKIDATA wdt:P112 ?founder.}}
+            OPTIONAL {{?WIKIDATA wdt:P138 ?named_after.}}
             OPTIONAL {{?WIKIDATA wdt:P1451 ?slogan. FILTER(LANG(?slogan) = "en")}}
             OPTIONAL {{?WIKIDATA wdt:P1128 ?employees_count.}}
-            OPTIONAL {{?WIKIDATA wdt:P1365 ?replaces. ?replaces rdfs:label ?replaces_label. FILTER(LANG(?replaces_label) = "en")}}
-            OPTIONAL {{?WIKIDATA wdt:P1366 ?replaced_by. ?replaced_by rdfs:label ?replaced_by_label. FILTER(LANG(?replaced_by_label) = "en")}}
+            OPTIONAL {{?WIKIDATA wdt:P1365 ?replaces.}}
+            OPTIONAL {{?WIKIDATA wdt:P1366 ?replaced_by.}}
             OPTIONAL {{?WIKIDATA wdt:P1278 ?lei.}}
         }} GROUP BY ?WIKIDATA"""
 
 def get_people_query(wikidata_id):
-    return f"""SELECT (GROUP_CONCAT(DISTINCT ?ceo_formatted; separator="; ") AS ?CEOS_HISTORY) (GROUP_CONCAT(DISTINCT ?owner_formatted; separator="; ") AS ?OWNERS_HISTORY) (GROUP_CONCAT(DISTINCT ?BOARD_MEMBER_label; separator=", ") AS ?BOARD_MEMBERS) WHERE {{
+    return f"""SELECT (GROUP_CONCAT(DISTINCT ?ceo_formatted; separator="; ") AS ?CEOS_HISTORY) (GROUP_CONCAT(DISTINCT ?owner_formatted; separator="; ") AS ?OWNERS_HISTORY) (GROUP_CONCAT(DISTINCT {qid("BOARD_MEMBER")}; separator=", ") AS ?BOARD_MEMBERS) WHERE {{
         VALUES ?WIKIDATA {{ wd:{wikidata_id} }}
         OPTIONAL {{
             ?WIKIDATA p:P169 ?ceo_statement. ?ceo_statement ps:P169 ?ceo_item.
-            ?ceo_item rdfs:label ?ceo_label. FILTER(LANG(?ceo_label) = "en").
             OPTIONAL {{ ?ceo_statement pq:P580 ?start_date. }} OPTIONAL {{ ?ceo_statement pq:P582 ?end_date. }}
-            BIND(CONCAT(?ceo_label, " (from ", COALESCE(STR(YEAR(?start_date)), "?"), " to ", COALESCE(STR(YEAR(?end_date)), "present"), ")") AS ?ceo_formatted)
+            BIND(CONCAT({qid("ceo_item")}, " (from ", COALESCE(STR(YEAR(?start_date)), "?"), " to ", COALESCE(STR(YEAR(?end_date)), "present"), ")") AS ?ceo_formatted)
         }}
         OPTIONAL {{
             ?WIKIDATA p:P127 ?owner_statement. ?owner_statement ps:P127 ?owner_item.
-            ?owner_item rdfs:label ?owner_label. FILTER(LANG(?owner_label) = "en").
             OPTIONAL {{ ?owner_statement pq:P585 ?owner_date. }}
-            BIND(CONCAT(?owner_label, " (as of ", COALESCE(STR(YEAR(?owner_date)), "?"), ")") AS ?owner_formatted)
+            BIND(CONCAT({qid("owner_item")}, " (as of ", COALESCE(STR(YEAR(?owner_date)), "?"), ")") AS ?owner_formatted)
         }}
-        OPTIONAL {{?WIKIDATA wdt:P3320 ?BOARD_MEMBER. ?BOARD_MEMBER rdfs:label ?BOARD_MEMBER_label. FILTER(LANG(?BOARD_MEMBER_label) = "en")}}
+        OPTIONAL {{?WIKIDATA wdt:P3320 ?BOARD_MEMBER.}}
     }} GROUP BY ?WIKIDATA"""
 
 def get_corporate_query(wikidata_id):
-    return f"""SELECT (GROUP_CONCAT(DISTINCT ?PARENT_ORGANIZATION_label; separator=", ") AS ?PARENT_ORGANIZATIONS) (GROUP_CONCAT(DISTINCT ?SUBSIDIARY_label; separator=", ") AS ?SUBSIDIARIES) (GROUP_CONCAT(DISTINCT ?PRODUCT_label; separator=", ") AS ?PRODUCTS_SERVICES) WHERE {{
+    return f"""SELECT (GROUP_CONCAT(DISTINCT {qid("PARENT_ORGANIZATION")}; separator=", ") AS ?PARENT_ORGANIZATIONS) (GROUP_CONCAT(DISTINCT {qid("SUBSIDIARY")}; separator=", ") AS ?SUBSIDIARIES) (GROUP_CONCAT(DISTINCT {qid("PRODUCT")}; separator=", ") AS ?PRODUCTS_SERVICES) WHERE {{
         VALUES ?WIKIDATA {{ wd:{wikidata_id} }}
-        OPTIONAL {{?WIKIDATA wdt:P749 ?PARENT_ORGANIZATION. ?PARENT_ORGANIZATION rdfs:label ?PARENT_ORGANIZATION_label. FILTER(LANG(?PARENT_ORGANIZATION_label) = "en")}}
-        OPTIONAL {{?WIKIDATA wdt:P355 ?SUBSIDIARY. ?SUBSIDIARY rdfs:label ?SUBSIDIARY_label. FILTER(LANG(?SUBSIDIARY_label) = "en")}}
-        OPTIONAL {{?WIKIDATA wdt:P1056 ?PRODUCT. ?PRODUCT rdfs:label ?PRODUCT_label. FILTER(LANG(?PRODUCT_label) = "en")}}
+        OPTIONAL {{?WIKIDATA wdt:P749 ?PARENT_ORGANIZATION.}}
+        OPTIONAL {{?WIKIDATA wdt:P355 ?SUBSIDIARY.}}
+        OPTIONAL {{?WIKIDATA wdt:P1056 ?PRODUCT.}}
     }} GROUP BY ?WIKIDATA"""
 
 def get_social_query(wikidata_id):
@@ -112,14 +131,14 @@ def get_social_query(wikidata_id):
 
 def get_stock_info_query(wikidata_id):
     return f"""SELECT
-        (GROUP_CONCAT(DISTINCT ?stock_exchange_label; separator=", ") AS ?STOCK_EXCHANGES)
+        (GROUP_CONCAT(DISTINCT {qid("stock_exchange")}; separator=", ") AS ?STOCK_EXCHANGES)
         (GROUP_CONCAT(DISTINCT ?ticker_symbol; separator=", ") AS ?TICKER_SYMBOLS)
         (GROUP_CONCAT(DISTINCT ?isin; separator=", ") AS ?ISIN_CODES)
         (SAMPLE(?sec_cik) AS ?SEC_CIK_NUMBER)
         (SAMPLE(?swift_bic) AS ?SWIFT_BIC_CODE)
         WHERE {{
         VALUES ?WIKIDATA {{ wd:{wikidata_id} }}
-        OPTIONAL {{?WIKIDATA wdt:P414 ?stock_exchange. ?stock_exchange rdfs:label ?stock_exchange_label. FILTER(LANG(?stock_exchange_label) = "en")}}
+        OPTIONAL {{?WIKIDATA wdt:P414 ?stock_exchange.}}
         OPTIONAL {{?WIKIDATA wdt:P249 ?ticker_symbol.}}
         OPTIONAL {{?WIKIDATA wdt:P946 ?isin.}}
         OPTIONAL {{?WIKIDATA wdt:P5531 ?sec_cik.}}
@@ -170,21 +189,19 @@ def get_financial_history_query(wikidata_id):
 
 def get_brands_query(wikidata_id):
     return f"""SELECT
-        (GROUP_CONCAT(DISTINCT ?brand_owned_label; separator=", ") AS ?BRANDS_OWNED)
-        (GROUP_CONCAT(DISTINCT ?parent_brand_label; separator=", ") AS ?PARENT_BRANDS)
+        (GROUP_CONCAT(DISTINCT {qid("brand_owned")}; separator=", ") AS ?BRANDS_OWNED)
+        (GROUP_CONCAT(DISTINCT {qid("parent_brand")}; separator=", ") AS ?PARENT_BRANDS)
         WHERE {{
         VALUES ?WIKIDATA {{ wd:{wikidata_id} }}
-        OPTIONAL {{?WIKIDATA wdt:P1830 ?brand_owned. ?brand_owned rdfs:label ?brand_owned_label. FILTER(LANG(?brand_owned_label) = "en")}}
-        OPTIONAL {{?WIKIDATA wdt:P8345 ?parent_brand. ?parent_brand rdfs:label ?parent_brand_label. FILTER(LANG(?parent_brand_label) = "en")}}
+        OPTIONAL {{?WIKIDATA wdt:P1830 ?brand_owned.}}
+        OPTIONAL {{?WIKIDATA wdt:P8345 ?parent_brand.}}
     }} GROUP BY ?WIKIDATA"""
 
-def main():
-    wikidata_id = "Q182439" # Nvidia
-    if len(sys.argv) > 1:
-        wikidata_id = sys.argv[1]
-
-    print(f"Extracting data for {wikidata_id}...")
-
+def extract_company(wikidata_id):
+    """
+    Run all profile queries for one company and merge them into a single binding.
+    Referenced entities are still raw QIDs (see resolve_entity_labels).
+    """
     results = {
         'core': get_sparql_results(get_core_info_query(wikidata_id)),
         'people': get_sparql_results(get_people_query(wikidata_id)),
@@ -210,14 +227,56 @@ def main():
         merged_binding['FINANCIAL_HISTORY'] = { 'value': results['financialHistory']['results']['bindings'] }
         all_vars.append('FINANCIAL_HISTORY')
 
-    unique_vars = list(set(all_vars))
-    final_output = { 'head': { 'vars': unique_vars }, 'results': { 'bindings': [merged_binding] } }
+    unique_vars = list(dict.fromkeys(all_vars))
+    return { 'head': { 'vars': unique_vars }, 'results': { 'bindings': [merged_binding] } }
+
+def resolve_entity_labels(outputs, cache, languages=None):
+    """
+    Replace the QIDs in ENTITY_FIELDS of every output with their labels, resolving
+    all of them (across all companies) with one cache lookup. QIDs without a label are kept.
+    """
+    bindings = [b for output in outputs for b in output['results']['bindings']]
+    qids = set()
+    for binding in bindings:
+        for field in ENTITY_FIELDS:
+            if field in binding:
+                qids.update(QID_TOKEN.findall(binding[field]['value']))
+
+    labels = cache.resolve(sorted(qids), languages)
+    for binding in bindings:
+        for field in ENTITY_FIELDS:
+            if field in binding:
+                value = QID_TOKEN.sub(lambda m: labels.get(m.group(0), m.group(0)), binding[field]['value'])
+                binding[field]['value'] = value
+    return outputs
+
+def main():
+    wikidata_ids = ["Q182439"] # Nvidia
+    languages = ['en']
+    args = sys.argv[1:]
+    if '--lang' in args:
+        i = args.index('--lang')
+        languages = args[i + 1].split(',')
+        args = args[:i] + args[i + 2:]
+    if args:
+        wikidata_ids = args
+
+    outputs = []
+    for wikidata_id in wikidata_ids:
+        print(f"Extracting data for {wikidata_id}...")
+        outputs.append(extract_company(wikidata_id))
+
+    cache = LabelCache(languages=languages)
+    cached = len(cache)
+    resolve_entity_labels(outputs, cache)
+    print(f"Resolved labels via cache ({cached} cached, {len(cache) - cached} fetched).")
 
-    output_path = f"tests/nvidia.json"
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(final_output, f, indent=2, ensure_ascii=False)
+    for wikidata_id, final_output in zip(wikidata_ids, outputs):
+        output_path = f"tests/nvidia.json" if len(wikidata_ids) == 1 else f"tests/{wikidata_id}.json"
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(final_output, f, indent=2, ensure_ascii=False)
 
-    print(f"Data saved to {output_path}")
+        print(f"Data saved to {output_path}")
 
 if __name__ == "__main__":
     main()
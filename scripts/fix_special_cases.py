@@ -1,7 +1,7 @@
-import pandas as pd
+from csv_patch import apply_diff, cell_diff, load_csv
 
 CSV_PATH = 'data/companies.csv'
-df = pd.read_csv(CSV_PATH)
+df = load_csv(CSV_PATH)
 
 fixes = {
     'AVIC': 'Q790835',
@@ -9,8 +9,13 @@ fixes = {
     'Eviden': 'Q118322695'
 }
 
-for name, qid in fixes.items():
-    df.loc[df['COMPANY'] == name, 'Wikidata'] = qid
+fixed = df.copy()
+fixed.loc[fixed['COMPANY'].isin(fixes.keys()), 'Wikidata'] = fixed['COMPANY'].map(fixes)
 
-df.to_csv(CSV_PATH, index=False)
-print("Manually fixed AVIC, CASC, and Eviden in CSV.")
+# Only rows whose ID actually changes are rewritten
+diff = cell_diff(df, fixed)
+rows = apply_diff(CSV_PATH, df, fixed, diff, source='fix_special_cases')
+if rows:
+    print(f"Manually fixed {', '.join(diff['company'])} in CSV.")
+else:
+    print("AVIC, CASC and Eviden already fixed in CSV, nothing written.")
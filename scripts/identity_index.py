@@ -0,0 +1,328 @@
+import re
+import unicodedata
+from urllib.parse import unquote
+
+import numpy as np
+import pandas as pd
+
+# Lookup priority: the first key that resolves wins, the others are only
+# checked for conflicts.
+KEY_TYPES = ('qid', 'lei', 'tax_id', 'wikipedia', 'name')
+
+LEGAL_SUFFIXES = {
+    'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'ltd',
+    'limited', 'plc', 'se', 'sa', 'ag', 'nv', 'spa', 'llc'
+}
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and value != value) or str(value).strip().lower() in ('', 'nan')
+
+def normalize_qid(value):
+    """
+    'Q821293', 'https://www.wikidata.org/wiki/Q821293' -> 'Q821293'.
+    """
+    if _is_missing(value):
+        return None
+    match = re.search(r'Q\d+', str(value).strip().upper())
+    return match.group(0) if match else None
+
+def normalize_name(value):
+    """
+    Case/accent/punctuation-insensitive company name, without trailing legal forms
+    (e.g. 'Albemarle Corp.' -> 'albemarle').
+    """
+    if _is_missing(value):
+        return None
+    text = unicodedata.normalize('NFKD', str(value)).encode('ascii', 'ignore').decode('ascii')
+    text = text.casefold().replace('&', ' and ')
+    words = re.sub(r'[^a-z0-9]+', ' ', text).split()
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    return ' '.join(words) or None
+
+def normalize_wikipedia_url(value):
+    """
+    'http://en.wikipedia.org/wiki/Rio_Tinto_Group/' -> 'en.wikipedia.org/wiki/rio tinto group'.
+    """
+    if _is_missing(value):
+        return None
+    url = unquote(str(value).strip())
+    url = re.sub(r'^https?://', '', url, flags=re.IGNORECASE)
+    url = url.split('#')[0].split('?')[0].rstrip('/')
+    url = url.replace('en.m.wikipedia.org', 'en.wikipedia.org')
+    return url.replace('_', ' ').casefold() or None
+
+def normalize_tax_id(value):
+    """
+    '96 004 458 404 (ABN)' -> '96004458404', 'GB 805 2374 88 (VAT)' -> 'GB805237488'.
+    The scheme in parentheses is dropped, so the same number matches with or without it.
+    """
+    if _is_missing(value):
+        return None
+    number = str(value).split('(')[0]
+    return re.sub(r'[^0-9A-Z]', '', number.upper()) or None
+
+def normalize_lei(value):
+    """
+    LEIs are 20 alphanumeric characters (ISO 17442); anything else is ignored.
+    """
+    if _is_missing(value):
+        return None
+    lei = re.sub(r'[^0-9A-Z]', '', str(value).upper())
+    return lei if len(lei) == 20 else None
+
+NORMALIZERS = {
+    'qid': normalize_qid,
+    'lei': normalize_lei,
+    'tax_id': normalize_tax_id,
+    'wikipedia': normalize_wikipedia_url,
+    'name': normalize_name,
+}
+
+def identity_keys(qid=None, name=None, wikipedia=None, tax_id=None, lei=None):
+    """
+    Normalize the raw identifiers of a record into {key_type: value}, skipping empty ones.
+    """
+    raw = {'qid': qid, 'lei': lei, 'tax_id': tax_id, 'wikipedia': wikipedia, 'name': name}
+    keys = {}
+    for key_type in KEY_TYPES:
+        value = NORMALIZERS[key_type](raw[key_type])
+        if value:
+            keys[key_type] = value
+    return keys
+
+def row_keys(row):
+    """
+    Identity keys of a companies.csv row (dict or pandas Series).
+    """
+    return identity_keys(
+        qid=row.get('Wikidata'),
+        name=row.get('COMPANY'),
+        wikipedia=row.get('Wikipedia url'),
+        tax_id=row.get('TAX ID'),
+        lei=row.get('LEI'),
+    )
+
+def record_keys(item):
+    """
+    Identity keys of a companies.json entry.
+    """
+    return identity_keys(
+        qid=item.get('id'),
+        name=item.get('label'),
+        wikipedia=item.get('wikipedia'),
+        tax_id=item.get('tax_id'),
+        lei=item.get('lei'),
+    )
+
+class IdentityIndex:
+    """
+    Maps every identity key (QID, LEI, TAX ID, Wikipedia URL, normalized name)
+    to a single canonical record, with O(1) lookup on any key.
+    Keys are first-come: a key already owned by another record is not stolen,
+    the clash is recorded in `conflicts` instead.
+    Two different QIDs are never the same entity, whatever the other keys say.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._owner = {}  # (key_type, value) -> position in self.records
+        self._qids = []  # normalized QID of each record, or None
+        self._reported = set()  # (key_type, value) clashes reported by the last resolve()
+        self.conflicts = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def _label(self, position):
+        record = self.records[position]
+        return record.get('label') or record.get('id') or f"#{position}"
+
+    def _conflict(self, key_type, value, position, other_label):
+        self._reported.add((key_type, value))
+        self.conflicts.append({
+            'key': key_type,
+            'value': value,
+            'existing': self._label(position),
+            'incoming': other_label,
+        })
+
+    def lookup(self, key_type, value):
+        position = self._owner.get((key_type, value))
+        return None if position is None else self.records[position]
+
+    def resolve(self, keys, label=None):
+        """
+        Return the canonical record matching `keys` (highest-priority key first), or None.
+        Keys pointing at two different records are reported as conflicts, and so are
+        records matched on a lower-priority key but carrying another QID (not resolved).
+        """
+        self._reported = set()
+        qid = keys.get('qid')
+        match = None
+        for key_type in KEY_TYPES:
+            value = keys.get(key_type)
+            if value is None:
+                continue
+            position = self._owner.get((key_type, value))
+            if position is None:
+                continue
+            if qid and self._qids[position] and self._qids[position] != qid:
+                self._conflict(key_type, value, position, f"{label or qid} ({qid})")
+                continue
+            if match is None:
+                match = position
+            elif position != match:
+                self._conflict(key_type, value, position, label or self._label(match))
+        return None if match is None else self.records[match]
+
+    def add(self, record, keys):
+        """
+        Register `record` as canonical for all of `keys` it doesn't clash on.
+        Clashes the preceding resolve() of the same keys already reported are not repeated.
+        """
+        position = len(self.records)
+        self.records.append(record)
+        self._qids.append(keys.get('qid'))
+        reported, self._reported = self._reported, set()
+        for key_type, value in keys.items():
+            owner = self._owner.setdefault((key_type, value), position)
+            if owner != position and (key_type, value) not in reported:
+                self._conflict(key_type, value, owner, self._label(position))
+        self._reported = set()
+        return record
+
+    def report_conflicts(self):
+        if not self.conflicts:
+            return
+        print(f"--- {len(self.conflicts)} identity key conflicts ---")
+        for c in self.conflicts:
+            print(f"  CONFLICT [{c['key']}={c['value']}]: '{c['incoming']}' vs existing '{c['existing']}'")
+
+# Vectorized counterparts of the normalizers above, for whole pandas columns.
+# They must produce the same keys as the scalar versions.
+
+def _blank_to_na(series):
+    s = series.astype(object)
+    s = s.where(s.notna()).astype(str).str.strip()
+    return s.mask(s.str.lower().isin(['', 'nan']))
+
+CANONICAL_QID = re.compile(r'Q\d+')
+
+def normalize_qids(series):
+    # Nearly every cell is already a bare QID: skip the full normalization for those
+    fullmatch = CANONICAL_QID.fullmatch
+    values = [v if type(v) is str and fullmatch(v) else normalize_qid(v) for v in series.to_numpy(dtype=object)]
+    return pd.Series(values, index=series.index, dtype=object)
+
+def normalize_names(series):
+    s = _blank_to_na(series)
+    if s.isna().all():
+        return s  # .str.encode() of an all-missing column is not a string column
+    s = s.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+    s = s.str.casefold().str.replace('&', ' and ', regex=False)
+    s = s.str.replace(r'[^a-z0-9]+', ' ', regex=True).str.strip()
+    suffixes = '|'.join(sorted(LEGAL_SUFFIXES))
+    s = s.str.replace(rf'(?<=\S)(?:\s+(?:{suffixes}))+$', '', regex=True)
+    return s.mask(s == '')
+
+def normalize_wikipedia_urls(series):
+    s = _blank_to_na(series)
+    encoded = s.str.contains('%', regex=False, na=False)
+    s[encoded] = s[encoded].map(unquote)
+    s = s.str.replace(r'^https?://', '', regex=True, case=False)
+    s = s.str.replace(r'[#?].*', '', regex=True, flags=re.S).str.rstrip('/')
+    s = s.str.replace('en.m.wikipedia.org', 'en.wikipedia.org', regex=False)
+    s = s.str.replace('_', ' ', regex=False).str.casefold()
+    return s.mask(s == '')
+
+def normalize_tax_ids(series):
+    s = _blank_to_na(series).str.replace(r'\(.*', '', regex=True, flags=re.S).str.upper()
+    s = s.str.replace(r'[^0-9A-Z]', '', regex=True)
+    return s.mask(s == '')
+
+def normalize_leis(series):
+    s = _blank_to_na(series).str.upper().str.replace(r'[^0-9A-Z]', '', regex=True)
+    return s.where(s.str.len() == 20)
+
+FRAME_NORMALIZERS = {
+    'qid': normalize_qids,
+    'lei': normalize_leis,
+    'tax_id': normalize_tax_ids,
+    'wikipedia': normalize_wikipedia_urls,
+    'name': normalize_names,
+}
+
+CSV_COLUMNS = {'qid': 'Wikidata', 'name': 'COMPANY', 'wikipedia': 'Wikipedia url', 'tax_id': 'TAX ID', 'lei': 'LEI'}
+RECORD_COLUMNS = {'qid': 'id', 'name': 'label', 'wikipedia': 'wikipedia', 'tax_id': 'tax_id', 'lei': 'lei'}
+
+def resolve_frame(left, right, left_columns=CSV_COLUMNS, right_columns=RECORD_COLUMNS, check_conflicts=True):
+    """
+    Vectorized IdentityIndex.resolve: one hash join per key type, in priority order.
+    Returns, for every row of `left`, the position of the matching `right` row
+    (first-come on each key, highest-priority key wins) as a nullable Int64 Series,
+    and the conflicts as dicts (row, key, value, chosen, other).
+    A row is never matched to a `right` row carrying a different QID: such candidates are
+    reported as conflicts with chosen=None (or the row's current match) and skipped.
+    With check_conflicts=False, rows matched on their QID are trusted: lower-priority keys
+    are only normalized (and checked for conflicts) for the other rows, which skips most of
+    the work once rows carry their QID.
+    """
+    match = pd.Series(pd.NA, index=left.index, dtype='Int64')
+    by_qid = np.zeros(len(left), dtype=bool)
+    conflicts = []
+    left_qids = right_qids = None
+    if left_columns.get('qid') in left.columns and right_columns.get('qid') in right.columns:
+        left_qid_keys = normalize_qids(left[left_columns['qid']])
+        right_qid_keys = normalize_qids(right[right_columns['qid']])
+        left_qids = left_qid_keys.to_numpy(dtype=object)
+        right_qids = right_qid_keys.to_numpy(dtype=object)
+    for key_type in KEY_TYPES:
+        left_column, right_column = left_columns.get(key_type), right_columns.get(key_type)
+        if left_column not in left.columns or right_column not in right.columns:
+            continue
+        rows = left.index if check_conflicts else left.index[~by_qid]
+        if len(rows) == 0:
+            break
+
+        normalize = FRAME_NORMALIZERS[key_type]
+        if key_type == 'qid' and left_qids is not None:
+            right_keys, left_keys = right_qid_keys, left_qid_keys.loc[rows]
+        else:
+            right_keys, left_keys = normalize(right[right_column]), normalize(left.loc[rows, left_column])
+        has_key = right_keys.notna().to_numpy()
+        owners = pd.Series(np.flatnonzero(has_key), index=right_keys.to_numpy()[has_key])
+        owners = owners[~owners.index.duplicated(keep='first')]
+        candidate = left_keys.map(owners).astype('Int64').reindex(left.index)
+
+        if left_qids is not None and key_type != 'qid':
+            found = candidate.notna().to_numpy(dtype=bool)
+            other_qids = np.full(len(left), None, dtype=object)
+            other_qids[found] = right_qids[candidate[found].to_numpy(dtype=int)]
+            mismatch = found & pd.notna(left_qids) & pd.notna(other_qids)
+            mismatch[mismatch] = left_qids[mismatch] != other_qids[mismatch]
+            if mismatch.any():
+                rejected = pd.DataFrame({
+                    'row': left.index[mismatch],
+                    'key': key_type,
+                    'value': left_keys.reindex(left.index)[mismatch].to_numpy(),
+                    'chosen': match[mismatch].astype(object).where(match[mismatch].notna(), None).to_numpy(),
+                    'other': candidate[mismatch].to_numpy(dtype=int),
+                })
+                conflicts.extend(rejected.to_dict('records'))
+                candidate[mismatch] = pd.NA
+
+        clash = (candidate.notna() & match.notna() & (candidate != match)).fillna(False).to_numpy(dtype=bool)
+        if clash.any():
+            clashes = pd.DataFrame({
+                'row': left.index[clash],
+                'key': key_type,
+                'value': left_keys.reindex(left.index)[clash].to_numpy(),
+                'chosen': match[clash].to_numpy(dtype=int),
+                'other': candidate[clash].to_numpy(dtype=int),
+            })
+            conflicts.extend(clashes.to_dict('records'))
+        match = match.fillna(candidate)
+        if key_type == 'qid':
+            by_qid = match.notna().to_numpy(dtype=bool)
+    return match, conflicts
@@ -0,0 +1,106 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from company_store import atomic_write
+
+LABEL_CACHE_PATH = 'data/label_cache.jsonl'
+WIKIDATA_API = "https://www.wikidata.org/w/api.php"
+# wbgetentities accepts at most 50 ids per call
+BATCH_SIZE = 50
+WORKERS = 4
+
+class LabelCache:
+    """
+    Persistent QID -> {language: label} cache, shared by every extraction run.
+    Misses are filled with batched wbgetentities calls and appended to a JSONL file
+    (later lines win), so popular entities (countries, exchanges...) are fetched once.
+    A language fetched without result is stored as None, so it is not asked again.
+    """
+
+    def __init__(self, path=LABEL_CACHE_PATH, languages=('en',), read_paths=()):
+        """
+        `read_paths` are extra cache files loaded read-only before `path`; new labels are
+        only appended to `path` (e.g. one file per pipeline shard, merged afterwards).
+        """
+        self.path = path
+        self.languages = list(languages)
+        self.labels = {}
+        for p in [*read_paths, path]:
+            if os.path.exists(p):
+                with open(p, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self.labels.setdefault(entry['id'], {}).update(entry['labels'])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get(self, qid, languages=None):
+        """
+        Cached label of `qid` in the first of `languages` that has one, or None.
+        """
+        cached = self.labels.get(qid, {})
+        for lang in languages or self.languages:
+            if cached.get(lang):
+                return cached[lang]
+        return None
+
+    def _missing(self, qids, languages):
+        return [q for q in dict.fromkeys(qids) if any(lang not in self.labels.get(q, {}) for lang in languages)]
+
+    def _fetch(self, batch, languages):
+        params = {
+            'action': 'wbgetentities',
+            'ids': '|'.join(batch),
+            'props': 'labels',
+            'languages': '|'.join(languages),
+            'format': 'json',
+        }
+        try:
+            res = requests.get(WIKIDATA_API, params=params, headers={'User-Agent': 'ManintheloopSync/1.0'}, timeout=60)
+            res.raise_for_status()
+            entities = res.json().get('entities', {})
+        except Exception as e:
+            print(f"  [!] Error fetching labels for {len(batch)} entities: {e}")
+            return {}
+        fetched = {}
+        for qid in batch:
+            labels = entities.get(qid, {}).get('labels', {})
+            fetched[qid] = {lang: labels.get(lang, {}).get('value') for lang in languages}
+        return fetched
+
+    def resolve(self, qids, languages=None):
+        """
+        {qid: label} for all `qids`, fetching only cache misses, 50 ids per call.
+        QIDs without a label in any of `languages` are left out.
+        """
+        languages = list(languages or self.languages)
+        missing = self._missing(qids, languages)
+        if missing:
+            batches = [missing[i:i+BATCH_SIZE] for i in range(0, len(missing), BATCH_SIZE)]
+            with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+                results = list(pool.map(lambda batch: self._fetch(batch, languages), batches))
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for fetched in results:
+                    for qid, labels in fetched.items():
+                        self.labels.setdefault(qid, {}).update(labels)
+                        f.write(json.dumps({'id': qid, 'labels': labels}, ensure_ascii=False) + '\n')
+
+        resolved = {}
+        for qid in qids:
+            label = self.get(qid, languages)
+            if label is not None:
+                resolved[qid] = label
+        return resolved
+
+    def compact(self):
+        """
+        Rewrite the append-only file with one line per entity.
+        """
+        with atomic_write(self.path) as f:
+            for qid in sorted(self.labels, key=lambda q: int(q[1:]) if q[1:].isdigit() else 0):
+                f.write(json.dumps({'id': qid, 'labels': self.labels[qid]}, ensure_ascii=False) + '\n')
@@ -0,0 +1,215 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import unquote
+
+import requests
+
+from company_store import atomic_write, iter_companies
+from sync_anagrafica import ENRICHMENT_FIELDS, enrich_from_wikidata
+
+LOGO_DIR = 'data/logos'
+MANIFEST_PATH = 'data/logos/manifest.json'
+
+THUMBNAIL_SIZE = 128
+# Commons renders SVGs (and downsizes large rasters) server-side when a width is requested,
+# so we never download the multi-megabyte originals.
+FETCH_WIDTH = 512
+DOWNLOAD_WORKERS = 8
+
+LOGO_FIELDS = [f for f in ENRICHMENT_FIELDS if f[0] == 'logo']
+
+def commons_file_name(url):
+    """
+    'http://commons.wikimedia.org/wiki/Special:FilePath/NVIDIA%20logo.svg' -> 'NVIDIA logo.svg'.
+    """
+    return unquote(url.rstrip('/').rsplit('/', 1)[-1])
+
+class HttpLogoSource:
+    """
+    Downloads logos from Wikimedia Commons.
+    """
+
+    def __init__(self, width=FETCH_WIDTH):
+        self.width = width
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'ManintheloopSync/1.0'
+
+    def fetch(self, url):
+        res = self.session.get(url, params={'width': self.width}, timeout=60)
+        res.raise_for_status()
+        return res.content
+
+class DirectoryLogoSource:
+    """
+    Reads logos from a local directory, by Commons file name (for tests and offline runs).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, url):
+        with open(os.path.join(self.directory, commons_file_name(url)), 'rb') as f:
+            return f.read()
+
+def resolve_logos(companies, resolved=None, without_logo=()):
+    """
+    {qid: logo URL} for every company, and the QIDs found to have no logo. Entries without
+    a 'logo' field (not enriched since the field was added, or no P154) are resolved with one
+    batched query per chunk, unless a previous run already did (`resolved`: {qid: URL},
+    `without_logo`: QIDs with none).
+    """
+    resolved = resolved or {}
+    known = set(without_logo)
+    logos = {}
+    checked = set()
+    missing = []
+    for c in companies:
+        if c.get('logo'):
+            logos[c['id']] = c['logo']
+        elif 'logo' in c:
+            continue
+        elif c['id'] in resolved:
+            logos[c['id']] = resolved[c['id']]
+        elif c['id'] in known:
+            checked.add(c['id'])
+        else:
+            missing.append(c['id'])
+    if missing:
+        print(f"Resolving logos for {len(missing)} companies from Wikidata...")
+        for qid, values in enrich_from_wikidata(missing, fields=LOGO_FIELDS).items():
+            if values.get('logo'):
+                logos[qid] = values['logo']
+            else:
+                checked.add(qid)
+    return logos, sorted(checked)
+
+def download_logos(urls, source, workers=DOWNLOAD_WORKERS):
+    """
+    Fetch every distinct URL concurrently. Returns ({url: sha256}, {sha256: content}),
+    so identical files served under different names are kept (and rendered) once.
+    """
+    def fetch(url):
+        try:
+            return url, source.fetch(url)
+        except Exception as e:
+            print(f"  [!] Could not fetch {url}: {e}")
+            return url, None
+
+    hashes = {}
+    blobs = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for url, content in pool.map(fetch, sorted(set(urls))):
+            if content is None:
+                continue
+            digest = hashlib.sha256(content).hexdigest()
+            hashes[url] = digest
+            blobs.setdefault(digest, content)
+    return hashes, blobs
+
+def render_thumbnail(job):
+    """
+    Render `content` as a size x size thumbnail (aspect ratio kept, transparent padding).
+    Runs in a worker process.
+    """
+    content, path, size, fmt = job
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            image = image.convert('RGBA')
+            image.thumbnail((size, size), Image.LANCZOS)
+            canvas = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+            canvas.paste(image, ((size - image.width) // 2, (size - image.height) // 2))
+            if fmt == 'webp':
+                canvas.save(path, 'WEBP', quality=80, method=6)
+            else:
+                canvas.save(path, 'PNG', optimize=True)
+    except Exception as e:
+        return path, str(e)
+    return path, None
+
+def thumbnail_path(digest, fmt):
+    return f"{LOGO_DIR}/{digest[:16]}.{fmt}"
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def prefetch_logos(source, size=THUMBNAIL_SIZE, fmt='webp', companies=None):
+    companies = list(iter_companies()) if companies is None else companies
+    # Logos resolved by a previous run are not queried again (the sync refreshes 'logo')
+    previous = load_manifest()
+    resolved = {qid: entry['source'] for qid, entry in previous.get('logos', {}).items()}
+    logos, without_logo = resolve_logos(companies, resolved, previous.get('without_logo', []))
+    print(f"{len(logos)} of {len(companies)} companies have a logo.")
+
+    # Reuse thumbnails from the previous run when the logo URL and rendering settings are unchanged
+    reusable = previous.get('logos', {}) if previous.get('size') == size and previous.get('format') == fmt else {}
+    manifest = {}
+    to_fetch = {}
+    for qid, url in logos.items():
+        old = reusable.get(qid)
+        if old and old['source'] == url and os.path.exists(old['thumbnail']):
+            manifest[qid] = old
+        else:
+            to_fetch[qid] = url
+
+    hashes, blobs = download_logos(to_fetch.values(), source)
+    print(f"Downloaded {len(hashes)} logos ({len(blobs)} distinct files), {len(manifest)} reused.")
+
+    os.makedirs(LOGO_DIR, exist_ok=True)
+    jobs = [(content, thumbnail_path(digest, fmt), size, fmt) for digest, content in blobs.items()]
+    failed = set()
+    with ProcessPoolExecutor() as pool:
+        for path, error in pool.map(render_thumbnail, jobs):
+            if error:
+                print(f"  [!] Could not render {path}: {error}")
+                failed.add(path)
+
+    for qid, url in to_fetch.items():
+        digest = hashes.get(url)
+        if digest is None or thumbnail_path(digest, fmt) in failed:
+            continue
+        path = thumbnail_path(digest, fmt)
+        manifest[qid] = {'source': url, 'sha256': digest, 'thumbnail': path, 'bytes': os.path.getsize(path)}
+
+    # Drop thumbnails no company points to anymore
+    referenced = {entry['thumbnail'] for entry in manifest.values()}
+    for name in os.listdir(LOGO_DIR):
+        path = f"{LOGO_DIR}/{name}"
+        if name.endswith(('.webp', '.png')) and path not in referenced:
+            os.remove(path)
+
+    with atomic_write(MANIFEST_PATH) as f:
+        json.dump({'size': size, 'format': fmt, 'logos': dict(sorted(manifest.items())), 'without_logo': without_logo},
+                  f, indent=2, ensure_ascii=False)
+    print(f"Wrote {len(manifest)} thumbnails to {MANIFEST_PATH}.")
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description="Download company logos and render local thumbnails.")
+    parser.add_argument('--source', help="Read logos from this directory (by Commons file name) instead of Commons")
+    parser.add_argument('--size', type=int, default=THUMBNAIL_SIZE, help="Thumbnail edge in pixels")
+    parser.add_argument('--png', action='store_true', help="Write PNG thumbnails instead of WebP")
+    args = parser.parse_args()
+
+    try:
+        from PIL import features
+    except ImportError:
+        print("Error: Pillow is required (pip install Pillow).")
+        return 1
+    fmt = 'png' if args.png or not features.check('webp') else 'webp'
+
+    source = DirectoryLogoSource(args.source) if args.source else HttpLogoSource()
+    prefetch_logos(source, size=args.size, fmt=fmt)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from company_store import JSON_PATH, JSONL_PATH, atomic_write, iter_companies, iter_jsonl, write_jsonl
+from extract_company_data import extract_company, resolve_entity_labels
+from identity_index import normalize_qid
+from label_cache import LABEL_CACHE_PATH, LabelCache
+from sync_anagrafica import CSV_PATH, ENRICHMENT_FIELDS, ENRICHMENT_WORKERS, assign_qids, enrich_companies, merge_partition, save_validated
+import wdqs
+
+SHARD_DIR = 'data/shards'
+PROFILE_DIR = 'data/profiles'
+METRICS_PATH = 'data/shards/metrics.json'
+PLAN_PATH = 'data/shards/plan.json'
+# Start of every JSONL store line (entries are written with the ID first)
+ID_PREFIX = '{"id": "'
+
+def shard_of(qid, shards):
+    """
+    Shard of a company: a hash of its QID that is the same on every run and machine
+    (unlike hash(), which is salted per process).
+    """
+    return int.from_bytes(hashlib.sha1(qid.encode('utf-8')).digest()[:8], 'big') % shards
+
+def shard_path(kind, index, shards, ext='jsonl'):
+    return f"{SHARD_DIR}/{kind}-{index:03d}-of-{shards:03d}.{ext}"
+
+def file_sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def iter_shard_companies(index, shards):
+    """
+    Existing entries of one shard. JSONL lines start with the QID, so the other shards'
+    lines are skipped without being parsed.
+    """
+    if not os.path.exists(JSONL_PATH):
+        if os.path.exists(JSON_PATH):
+            for item in iter_companies(JSON_PATH):
+                if shard_of(normalize_qid(item.get('id')) or '', shards) == index:
+                    yield item
+        return
+    with open(JSONL_PATH, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith(ID_PREFIX):
+                qid = line[len(ID_PREFIX):line.find('"', len(ID_PREFIX))]
+                if shard_of(normalize_qid(qid) or '', shards) != index:
+                    continue
+            line = line.strip()
+            if line:
+                item = json.loads(line)
+                if shard_of(normalize_qid(item.get('id')) or '', shards) == index:
+                    yield item
+
+def plan(shards):
+    """
+    Give every CSV row its QID (the only step that needs the whole list: searches and rows
+    without a QID cell), then split the rows into `shards` input files by QID hash.
+    """
+    df_csv = pd.read_csv(CSV_PATH)
+    print(f"Loaded {len(df_csv)} rows from CSV.")
+    assignments = assign_qids(df_csv)
+
+    buckets = [[] for _ in range(shards)]
+    for position, qid, rank in assignments:
+        buckets[shard_of(qid, shards)].append({'row': position, 'qid': qid, 'rank': rank})
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    for index, bucket in enumerate(buckets):
+        # Results of a previous plan must not be merged with this one
+        for stale in (shard_path('output', index, shards), shard_path('metrics', index, shards, 'json')):
+            if os.path.exists(stale):
+                os.remove(stale)
+        write_jsonl(shard_path('input', index, shards), bucket)
+    # Shards read the rows from the CSV: it must not change before they run
+    with atomic_write(PLAN_PATH) as f:
+        json.dump({'shards': shards, 'csv_sha1': file_sha1(CSV_PATH)}, f, indent=2)
+    print(f"Planned {len(assignments)} rows into {shards} shards: {', '.join(str(len(b)) for b in buckets)}")
+    return [len(b) for b in buckets]
+
+def run_shard(index, shards, workers=ENRICHMENT_WORKERS, profiles=False, languages=('en',)):
+    """
+    Merge with the existing JSON, enrich (and optionally extract the profiles of) one shard.
+    Reads only the CSV rows and existing entries of this shard's QIDs and writes only files
+    of this shard, so it can run in a worker process or on another machine.
+    """
+    tag = f"[shard {index + 1}/{shards}]"
+    started = time.monotonic()
+    if not os.path.exists(PLAN_PATH):
+        print(f"{tag} Error: no plan in {SHARD_DIR}, run --plan first.")
+        return None
+    with open(PLAN_PATH, 'r', encoding='utf-8') as f:
+        planned = json.load(f)
+    if planned['shards'] != shards or planned['csv_sha1'] != file_sha1(CSV_PATH):
+        print(f"{tag} Error: {CSV_PATH} or the shard count changed since the plan, run --plan again.")
+        return None
+
+    df_csv = pd.read_csv(CSV_PATH)
+    assignments = [(a['row'], a['qid'], a['rank']) for a in iter_jsonl(shard_path('input', index, shards))]
+    try:
+        existing = list(iter_shard_companies(index, shards))
+    except json.JSONDecodeError:
+        print(f"{tag} Warning: JSON file corrupted or empty. Starting fresh.")
+        existing = []
+    entries = merge_partition(df_csv, assignments, existing)
+    print(f"{tag} {len(entries)} companies")
+    merged = time.monotonic()
+
+    enrich_companies(entries, workers=workers)
+    enriched = time.monotonic()
+
+    extracted = 0
+    if profiles:
+        outputs = []
+        for entry in entries:
+            outputs.append(extract_company(entry['id']))
+        # New labels go to a per-shard file, merged into the shared cache afterwards
+        cache = LabelCache(shard_path('label_cache', index, shards), languages, read_paths=[LABEL_CACHE_PATH])
+        resolve_entity_labels(outputs, cache)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        for entry, output in zip(entries, outputs):
+            with atomic_write(f"{PROFILE_DIR}/{entry['id']}.json") as f:
+                json.dump(output, f, indent=2, ensure_ascii=False)
+        extracted = len(outputs)
+
+    write_jsonl(shard_path('output', index, shards), entries)
+
+    metrics = {
+        'shard': index,
+        'shards': shards,
+        'companies': len(entries),
+        'fields': sum(1 for e in entries for name, *_ in ENRICHMENT_FIELDS if name in e),
+        'profiles': extracted,
+        'merge_seconds': round(merged - started, 3),
+        'enrich_seconds': round(enriched - merged, 3),
+        'seconds': round(time.monotonic() - started, 3),
+    }
+    with atomic_write(shard_path('metrics', index, shards, 'json')) as f:
+        json.dump(metrics, f, indent=2)
+    print(f"{tag} done: {metrics['companies']} companies, {metrics['fields']} fields, "
+          f"{metrics['profiles']} profiles in {metrics['seconds']}s")
+    return metrics
+
+def merge(shards, profiles=False):
+    """
+    Collect the shard outputs, validate and save. The store is sorted by label (ties by QID),
+    so the result does not depend on the number of shards.
+    """
+    missing = [i for i in range(shards) if not os.path.exists(shard_path('output', i, shards))]
+    if missing:
+        print(f"Error: shards {', '.join(str(i) for i in missing)} of {shards} have not run yet.")
+        return False
+
+    entries = []
+    metrics = []
+    for index in range(shards):
+        output = list(iter_jsonl(shard_path('output', index, shards)))
+        planned = {a['qid'] for a in iter_jsonl(shard_path('input', index, shards))}
+        ids = [e['id'] for e in output]
+        if set(ids) != planned or len(ids) != len(planned):
+            print(f"Error: shard {index} of {shards} does not match its input (stale output?), rerun it.")
+            return False
+        entries.extend(output)
+        metrics_path = shard_path('metrics', index, shards, 'json')
+        if os.path.exists(metrics_path):
+            with open(metrics_path, 'r', encoding='utf-8') as f:
+                metrics.append(json.load(f))
+
+    if profiles:
+        caches = [shard_path('label_cache', i, shards) for i in range(shards)]
+        cache = LabelCache(read_paths=[p for p in caches if os.path.exists(p)])
+        cache.compact()
+        for path in caches:
+            if os.path.exists(path):
+                os.remove(path)
+        print(f"Merged shard label caches into {LABEL_CACHE_PATH} ({len(cache)} entities).")
+
+    if not save_validated(entries):
+        return False
+
+    slowest = max((m['seconds'] for m in metrics), default=0)
+    summary = {
+        'shards': shards,
+        'companies': len(entries),
+        'slowest_shard_seconds': slowest,
+        'total_shard_seconds': round(sum(m['seconds'] for m in metrics), 3),
+        'per_shard': metrics,
+    }
+    with atomic_write(METRICS_PATH) as f:
+        json.dump(summary, f, indent=2)
+    print(f"Merged {shards} shards: {len(entries)} companies, slowest shard {slowest}s "
+          f"(metrics in {METRICS_PATH}).")
+    return True
+
+def run_pipeline(shards, processes=None, profiles=False, languages=('en',)):
+    """
+    Plan, run every shard in a process pool, merge. WDQS allows few concurrent queries, so
+    the processes share ENRICHMENT_WORKERS request slots: more processes add CPU for the
+    merge and the parsing, not load on WDQS.
+    """
+    plan(shards)
+    processes = processes or min(shards, os.cpu_count() or 1)
+    slots = multiprocessing.BoundedSemaphore(ENRICHMENT_WORKERS)
+    with ProcessPoolExecutor(max_workers=processes, initializer=wdqs.set_slots, initargs=(slots,)) as pool:
+        futures = [pool.submit(run_shard, i, shards, ENRICHMENT_WORKERS, profiles, languages) for i in range(shards)]
+        for future in as_completed(futures):
+            future.result()
+    return merge(shards, profiles)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the sync pipeline split into shards by QID hash.")
+    parser.add_argument('--shards', type=int, default=1, help="Number of shards")
+    parser.add_argument('--processes', type=int, help="Worker processes (default: one per shard, up to the CPU count); they share ENRICHMENT_WORKERS Wikidata queries")
+    parser.add_argument('--plan', action='store_true', help="Only write the shard input files")
+    parser.add_argument('--shard', type=int, help="Only run this shard (0-based), e.g. on another machine")
+    parser.add_argument('--merge', action='store_true', help="Only merge the shard outputs and save")
+    parser.add_argument('--profiles', action='store_true', help=f"Also extract company profiles to {PROFILE_DIR}/")
+    parser.add_argument('--lang', default='en', help="Label languages for the profiles, e.g. en,it")
+    args = parser.parse_args()
+
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.shard is not None and not 0 <= args.shard < args.shards:
+        parser.error("--shard must be between 0 and --shards - 1")
+    if args.processes is not None and args.processes < 1:
+        parser.error("--processes must be at least 1")
+    languages = args.lang.split(',')
+
+    if not os.path.exists(CSV_PATH):
+        print(f"Error: {CSV_PATH} not found.")
+        return 1
+    # A single shard needs the plan, its input file, the CSV and the existing JSON
+    if args.shard is not None:
+        return 0 if run_shard(args.shard, args.shards, profiles=args.profiles, languages=languages) else 1
+    if args.plan:
+        plan(args.shards)
+        return 0
+    if args.merge:
+        return 0 if merge(args.shards, args.profiles) else 1
+    return 0 if run_pipeline(args.shards, args.processes, args.profiles, languages) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
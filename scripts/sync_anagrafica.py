@@ -3,9 +3,45 @@ import json
 import os
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from company_store import JSON_PATH, JSONL_PATH, iter_companies, save_companies
+from countries import normalize_country
+from identity_index import CSV_COLUMNS, RECORD_COLUMNS, IdentityIndex, normalize_qids, record_keys, resolve_frame, row_keys
+from validate_dataset import load_csv_frame, print_report, to_frame, validate
+import wdqs
 
 CSV_PATH = 'data/companies.csv'
-JSON_PATH = 'data/companies.json'
+
+SPARQL_URL = "https://query.wikidata.org/sparql"
+
+# Declarative enrichment: (JSON field, property path from the company, value type, SPARQL aggregate).
+# All fields are fetched by the same query, so adding one costs no extra round trip.
+# Value types: 'country' (label, normalized), 'label', 'string', 'int', 'date'.
+# MIN/MAX rather than SAMPLE, and sorted GROUP_CONCAT values, keep the result independent
+# of how the QIDs are chunked (and so of the shard count in run_pipeline.py).
+ENRICHMENT_FIELDS = [
+    ('country', 'wdt:P17', 'country', 'MIN'),
+    ('country_code', 'wdt:P17/wdt:P297', 'string', 'MIN'),
+    ('headquarters', 'wdt:P159', 'label', 'MIN'),
+    ('lei', 'wdt:P1278', 'string', 'MIN'),
+    ('ticker', 'wdt:P249', 'string', 'GROUP_CONCAT'),
+    ('inception', 'wdt:P571', 'date', 'MIN'),
+    ('employees', 'wdt:P1128', 'int', 'MAX'),
+    ('logo', 'wdt:P154', 'string', 'MIN'),
+]
+
+# Adaptive chunking: chunks grow while queries answer well under the target time,
+# and shrink (failed chunks are split and retried) when they are slow or time out.
+ENRICHMENT_WORKERS = 4
+CHUNK_SIZE = 50
+MIN_CHUNK_SIZE = 5
+MAX_CHUNK_SIZE = 400
+TARGET_QUERY_SECONDS = 10
+# Throttled queries (429/503) are retried as they are, after Retry-After or an exponential backoff
+THROTTLE_STATUSES = (429, 503)
+MAX_THROTTLE_RETRIES = 5
+BACKOFF_SECONDS = 2
 
 def get_wikidata_id_safe(name):
     """
@@ -37,95 +73,311 @@ def get_wikidata_id_safe(name):
     
     return None
 
-def get_wikidata_countries(qids):
+def build_enrichment_query(qids, fields=ENRICHMENT_FIELDS):
     """
-    Fetch country labels for a list of QIDs in a single SPARQL query.
+    One SPARQL query returning every field of ENRICHMENT_FIELDS for all `qids`.
     """
-    if not qids:
-        return {}
-    
     qids_str = " ".join([f"wd:{q}" for q in qids])
-    query = f"""
-    SELECT ?item ?countryLabel WHERE {{
+    selects = []
+    patterns = []
+    for name, path, kind, aggregate in fields:
+        if kind in ('label', 'country'):
+            patterns.append(f'OPTIONAL {{ ?item {path} ?{name}_item. ?{name}_item rdfs:label ?{name}. FILTER(LANG(?{name}) = "en") }}')
+        else:
+            patterns.append(f'OPTIONAL {{ ?item {path} ?{name}. }}')
+        if aggregate == 'GROUP_CONCAT':
+            selects.append(f'(GROUP_CONCAT(DISTINCT ?{name}; separator=", ") AS ?{name}_value)')
+        else:
+            selects.append(f'({aggregate}(?{name}) AS ?{name}_value)')
+    nl = "\n      "
+    return f"""
+    SELECT ?item {" ".join(selects)} WHERE {{
       VALUES ?item {{ {qids_str} }}
-      ?item wdt:P17 ?country.
-      SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
-    }}
+      {nl.join(patterns)}
+    }} GROUP BY ?item
+    """
+
+def convert_value(kind, raw):
+    if raw is None or raw == '':
+        return None
+    if kind == 'country':
+        return normalize_country(raw)
+    if kind == 'int':
+        return int(float(raw))
+    if kind == 'date':
+        return raw.split('T')[0]
+    return raw
+
+def retry_delay(res, attempt):
+    """
+    Seconds to wait before retrying a throttled request: Retry-After when it is
+    given in seconds, else an exponential backoff.
+    """
+    try:
+        return max(0.0, float(res.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return BACKOFF_SECONDS * 2 ** attempt
+
+def get_wikidata_properties(qids, fields=ENRICHMENT_FIELDS):
+    """
+    Fetch all enrichment fields for a chunk of QIDs in a single SPARQL query.
+    Returns ({qid: {field: value}}, elapsed seconds); the dict is None if the query failed.
+    Throttled requests are retried here; other failures (timeouts, 5xx) are left to the
+    caller, which splits the chunk.
     """
-    url = "https://query.wikidata.org/sparql"
     headers = {'User-Agent': 'ManintheloopSync/1.0', 'Accept': 'application/sparql-results+json'}
-    
-    countries = {}
+    query = build_enrichment_query(qids, fields)
+    values = {}
     try:
-        res = requests.get(url, params={'query': query}, headers=headers)
-        data = res.json()
-        for binding in data['results']['bindings']:
+        for attempt in range(MAX_THROTTLE_RETRIES + 1):
+            with wdqs.slot():
+                # Timed once a slot is free, so waiting on other processes does not shrink the chunks
+                started = time.monotonic()
+                res = requests.get(SPARQL_URL, params={'query': query}, headers=headers, timeout=60)
+            if res.status_code not in THROTTLE_STATUSES or attempt == MAX_THROTTLE_RETRIES:
+                break
+            delay = retry_delay(res, attempt)
+            print(f"  [!] Wikidata throttled the query ({res.status_code}), retrying {len(qids)} companies in {delay:.0f}s")
+            time.sleep(delay)
+        res.raise_for_status()
+        for binding in res.json()['results']['bindings']:
             qid = binding['item']['value'].split('/')[-1]
-            label = binding['countryLabel']['value']
-            countries[qid] = label
+            item = {}
+            for name, path, kind, aggregate in fields:
+                raw = binding.get(f"{name}_value", {}).get('value')
+                try:
+                    value = convert_value(kind, raw)
+                except (TypeError, ValueError):
+                    # One unreadable value only loses that field, not the whole chunk
+                    print(f"  [!] Skipping {name} of {qid}: cannot read {raw!r} as {kind}")
+                    continue
+                if value is not None and aggregate == 'GROUP_CONCAT':
+                    value = ', '.join(sorted(set(value.split(', '))))
+                if value is not None:
+                    item[name] = value
+            values[qid] = item
     except Exception as e:
-        print(f"  [!] Error fetching countries: {e}")
-    
-    return countries
+        print(f"  [!] Error fetching properties for {len(qids)} companies: {e}")
+        values = None
+    return values, time.monotonic() - started
 
-def normalize_country(name):
+def next_chunk_size(size, slowest, failed):
+    if failed or slowest > TARGET_QUERY_SECONDS:
+        return max(MIN_CHUNK_SIZE, size // 2)
+    if slowest < TARGET_QUERY_SECONDS / 4:
+        return min(MAX_CHUNK_SIZE, size * 2)
+    return size
+
+def enrich_from_wikidata(qids, fields=ENRICHMENT_FIELDS, workers=ENRICHMENT_WORKERS):
     """
-    Unify country names (e.g., China, People's Republic of China, Cina -> China).
+    Run the enrichment query over all QIDs: `workers` chunks at a time, with the
+    chunk size adapted after each wave to how long the queries took.
     """
-    if not name or str(name).lower() == 'nan':
-        return "Unknown"
-    
-    name_clean = name.strip().lower()
-    
-    # China normalization
-    china_variants = ["china", "people's republic of china", "cina", "prc"]
-    if any(v == name_clean for v in china_variants) or "people's republic of china" in name_clean:
-        return "China"
-    
-    # USA normalization
-    usa_variants = ["united states", "usa", "united states of america", "u.s.a.", "u.s."]
-    if any(v == name_clean for v in usa_variants) or "united states of america" in name_clean:
-        return "United States"
-
-    # UK normalization
-    uk_variants = ["united kingdom", "uk", "u.k.", "great britain"]
-    if any(v == name_clean for v in uk_variants):
-        return "United Kingdom"
-
-    # Czechia normalization
-    czech_variants = ["czech republic", "czechia", "czech rep."]
-    if any(v == name_clean for v in czech_variants):
-        return "Czechia"
-    
-    # Taiwan normalization
-    taiwan_variants = ["taiwan", "republic of china", "taiwan, province of china"]
-    if any(v == name_clean for v in taiwan_variants):
-        return "Taiwan"
-
-    # Netherlands normalization
-    netherlands_variants = ["netherlands", "the netherlands", "kingdom of the netherlands"]
-    if any(v == name_clean for v in netherlands_variants):
-        return "Netherlands"
-
-    # UK normalization
-    uk_variants = ["united kingdom", "uk", "u.k.", "great britain"]
-    if any(v == name_clean for v in uk_variants):
-        return "United Kingdom"
-
-    # South Korea normalization
-    skorea_variants = ["south korea", "republic of korea", "korea, south", "korea (republic of)"]
-    if any(v == name_clean for v in skorea_variants):
-        return "South Korea"
-
-    # Russia normalization
-    russia_variants = ["russia", "russian federation"]
-    if any(v == name_clean for v in russia_variants):
-        return "Russia"
-        
-    return name.strip().title() # title() ensures 'France', not 'france' or 'FRANCE'
+    results = {}
+    pending = list(dict.fromkeys(qids))
+    size = CHUNK_SIZE
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending:
+            wave = [pending[i:i+size] for i in range(0, min(len(pending), size * workers), size)]
+            pending = pending[sum(len(c) for c in wave):]
+            outcomes = list(pool.map(lambda chunk: get_wikidata_properties(chunk, fields), wave))
+
+            failed = []
+            for chunk, (values, elapsed) in zip(wave, outcomes):
+                if values is not None:
+                    results.update(values)
+                elif len(chunk) > MIN_CHUNK_SIZE:
+                    # Retry as two smaller, cheaper queries
+                    half = len(chunk) // 2
+                    failed.extend([chunk[:half], chunk[half:]])
+                else:
+                    print(f"  [!] Giving up on {len(chunk)} companies: {', '.join(chunk)}")
+            pending = [q for chunk in failed for q in chunk] + pending
+            size = next_chunk_size(size, max(elapsed for _, elapsed in outcomes), failed)
+    return results
+
+def load_existing():
+    """
+    Existing entries (JSONL store, or the JSON export); empty if there are none or they are corrupted.
+    """
+    if not (os.path.exists(JSONL_PATH) or os.path.exists(JSON_PATH)):
+        return []
+    try:
+        existing = list(iter_companies())
+    except json.JSONDecodeError:
+        print("Warning: JSON file corrupted or empty. Starting fresh.")
+        return []
+    print(f"Loaded {len(existing)} existing entries from JSON.")
+    return existing
+
+def csv_name(value):
+    name = '' if pd.isna(value) else str(value).strip()
+    return '' if name.lower() == 'nan' else name
+
+def csv_entry(row):
+    """
+    JSON entry (without ID) and identity keys of a CSV row.
+    """
+    description = row.get('MAIN FOCUS')
+    if pd.isna(description) or not str(description).strip():
+        description = row.get('SECTOR')
+    description = '' if pd.isna(description) else str(description).strip()
+    csv_country = normalize_country(row.get('COUNTRY', 'Unknown'))
+
+    entry = {
+        "id": None,
+        "label": csv_name(row.get('COMPANY')),
+        "description": description,
+        "country": csv_country # Default to normalized CSV, will be overridden by Wikidata
+    }
+    # Match on QID, TAX ID, Wikipedia URL or name, so a renamed company keeps its validated ID
+    keys = row_keys(row)
+    # Stored (normalized) so the next sync can match a renamed company without a QID cell
+    for key_type in ('wikipedia', 'tax_id'):
+        if key_type in keys:
+            entry[key_type] = keys[key_type]
+    return entry, keys
+
+def assign_qids(df_csv, existing=None):
+    """
+    Global pre-pass of the merge: the QID of every CSV row, as (position, qid, rank) tuples.
+    A row keeps its Wikidata cell; a row without one takes the QID of the existing entry,
+    then of the other CSV row, with its TAX ID, Wikipedia URL or name, and only the rest is
+    searched on Wikidata (once per company). Rank 1 marks QIDs that were not the row's own,
+    so on a duplicate the row that carries the QID wins. Rows without a name or a QID are left out.
+    """
+    names = [csv_name(v) for v in df_csv['COMPANY']] if 'COMPANY' in df_csv.columns else [''] * len(df_csv)
+    if 'Wikidata' in df_csv.columns:
+        qids = normalize_qids(df_csv['Wikidata']).tolist()
+    else:
+        qids = [None] * len(df_csv)
+    qids = [None if pd.isna(q) else q for q in qids]
+    ranks = [0] * len(df_csv)
+
+    def pending():
+        return [i for i, (name, qid) in enumerate(zip(names, qids)) if name and qid is None]
+
+    def take(rows, match, source_qids, rank):
+        for position, found in zip(rows, match):
+            if not pd.isna(found):
+                qids[position] = source_qids[int(found)]
+                ranks[position] = rank
+
+    # Renamed companies without a QID cell: matched to the existing entries
+    rows = pending()
+    if rows:
+        existing = load_existing() if existing is None else existing
+        if existing:
+            records = pd.DataFrame(existing, columns=list(RECORD_COLUMNS.values()))
+            match, _ = resolve_frame(df_csv.iloc[rows], records, check_conflicts=False)
+            take(rows, match, records['id'].tolist(), 0)
+
+    # Rows repeating a company of the CSV: matched to the rows that have a QID
+    rows = pending()
+    if rows:
+        known = [i for i, (name, qid) in enumerate(zip(names, qids)) if name and qid is not None]
+        if known:
+            others = df_csv.iloc[known].assign(Wikidata=[qids[i] for i in known])
+            match, _ = resolve_frame(df_csv.iloc[rows], others, CSV_COLUMNS, CSV_COLUMNS, check_conflicts=False)
+            take(rows, match, others['Wikidata'].tolist(), 1)
+
+    # The rest: one search per company, the repeats take its result
+    firsts = IdentityIndex()
+    repeats = {}
+    for position in pending():
+        keys = row_keys(df_csv.iloc[position])
+        first = firsts.resolve(keys, label=names[position])
+        if first:
+            repeats[position] = first['position']
+            continue
+        firsts.add({'position': position, 'label': names[position]}, keys)
+        print(f"Searching Wikidata ID for: {names[position]}")
+        found_id = get_wikidata_id_safe(names[position])
+        if found_id:
+            qids[position] = found_id
+            ranks[position] = 1
+            time.sleep(0.5)
+    for position, first in repeats.items():
+        qids[position] = qids[first]
+        ranks[position] = 1
+
+    return [(i, qid, rank) for i, (name, qid, rank) in enumerate(zip(names, qids, ranks)) if name and qid]
+
+def merge_partition(df_csv, assignments, existing):
+    """
+    Merge the CSV rows of `assignments` (see assign_qids) with the existing entries: keep
+    previously fetched fields and drop duplicate entities. Rows and entries only interact
+    through their QID, so the companies can be split by QID and merged separately.
+    """
+    existing_data = IdentityIndex()
+    for item in existing:
+        existing_data.add(item, record_keys(item))
+
+    merged = IdentityIndex()
+    for position, qid, rank in sorted(assignments, key=lambda a: (a[2], a[0])):
+        entry, keys = csv_entry(df_csv.iloc[position])
+        entry['id'] = keys['qid'] = qid
+        company_name = entry['label']
+
+        known = existing_data.resolve(keys, label=company_name)
+        if known:
+            # Previously fetched fields, kept only if this run's enrichment query fails
+            for name, *_ in ENRICHMENT_FIELDS:
+                if name != 'country' and name in known:
+                    entry[name] = known[name]
+
+        duplicate = merged.resolve(keys, label=company_name)
+        if duplicate:
+            print(f"  Skipping duplicate: '{company_name}' is already present as '{duplicate['label']}' ({duplicate['id']})")
+            continue
+        merged.add(entry, keys)
+
+    existing_data.report_conflicts()
+    merged.report_conflicts()
+    return merged.records
+
+def merge_companies(df_csv):
+    """
+    Merge the CSV rows with the existing JSON entries: keep validated IDs, take new IDs
+    from the CSV or a Wikidata search, and drop duplicate entities.
+    """
+    existing = load_existing()
+    return merge_partition(df_csv, assign_qids(df_csv, existing), existing)
+
+def enrich_companies(entries, workers=ENRICHMENT_WORKERS):
+    """
+    Batch Enrichment from Wikidata (country and every other ENRICHMENT_FIELDS entry), in place.
+    """
+    print(f"Enriching {', '.join(name for name, *_ in ENRICHMENT_FIELDS)} from Wikidata...")
+    enrichment = enrich_from_wikidata([e['id'] for e in entries if e['id']], workers=workers)
+
+    for entry in entries:
+        if entry['id'] not in enrichment:
+            continue  # query failed: the fields carried over from the previous run stay
+        # Fetched: a field that came back empty was removed on Wikidata (the CSV country stays)
+        for name, *_ in ENRICHMENT_FIELDS:
+            if name != 'country':
+                entry.pop(name, None)
+        entry.update(enrichment[entry['id']])
+    return entries
+
+def save_validated(entries):
+    """
+    Validate offline, then Save (the JSON is never written if a check fails).
+    """
+    report = validate(to_frame(entries), load_csv_frame(CSV_PATH))
+    print_report(report)
+    if not report['ok']:
+        print(f"Aborting: validation failed, {JSON_PATH} left untouched.")
+        return False
+
+    # Sorted by label A-Z, stored as JSONL and exported as the indented array for the frontend
+    print(f"Saving {len(entries)} companies to {JSONL_PATH} and {JSON_PATH}...")
+    save_companies(entries)
+    return True
 
 def sync_anagrafica():
-    print("--- Starting Sync: CSV -> JSON (with Wikidata Country Enrichment) ---")
+    print("--- Starting Sync: CSV -> JSON (with Wikidata Enrichment) ---")
     
     # 1. Load Source of Truth (CSV)
     if not os.path.exists(CSV_PATH):
@@ -135,79 +387,15 @@ def sync_anagrafica():
     df_csv = pd.read_csv(CSV_PATH)
     print(f"Loaded {len(df_csv)} rows from CSV.")
 
-    # 2. Load Existing Cache (JSON)
-    existing_data = {}
-    if os.path.exists(JSON_PATH):
-        with open(JSON_PATH, 'r') as f:
-            try:
-                json_list = json.load(f)
-                for item in json_list:
-                    existing_data[item['label']] = item
-                print(f"Loaded {len(json_list)} existing entries from JSON.")
-            except json.JSONDecodeError:
-                print("Warning: JSON file corrupted or empty. Starting fresh.")
-
-    # 3. Merge & Identify IDs to fetch countries for
-    temp_list = []
-    seen_ids = set()
-    
-    for index, row in df_csv.iterrows():
-        company_name = str(row.get('COMPANY', '')).strip()
-        if not company_name or company_name.lower() == 'nan':
-            continue
-            
-        description = str(row.get('MAIN FOCUS', row.get('SECTOR', 'nan')))
-        csv_country = normalize_country(row.get('COUNTRY', 'Unknown'))
-        
-        entry = {
-            "id": None,
-            "label": company_name,
-            "description": description,
-            "country": csv_country # Default to normalized CSV, will be overridden by Wikidata
-        }
-
-        if company_name in existing_data:
-            entry['id'] = existing_data[company_name]['id']
-        
-        if (entry['id'] is None) and ('Wikidata' in row) and pd.notna(row['Wikidata']):
-            wid = str(row['Wikidata']).strip()
-            if wid.startswith('Q'):
-                entry['id'] = wid
-
-        if entry['id'] is None:
-            print(f"Searching Wikidata ID for: {company_name}")
-            found_id = get_wikidata_id_safe(company_name)
-            if found_id:
-                entry['id'] = found_id
-                time.sleep(0.5)
-        
-        if entry['id'] and entry['id'] not in seen_ids:
-            temp_list.append(entry)
-            seen_ids.add(entry['id'])
-
-    # 4. Batch Enrichment of Countries from Wikidata
-    print("Enriching countries from Wikidata...")
-    all_ids = [e['id'] for e in temp_list if e['id']]
-    # Split into chunks of 50 for SPARQL
-    chunk_size = 50
-    wikidata_countries = {}
-    for i in range(0, len(all_ids), chunk_size):
-        chunk = all_ids[i:i+chunk_size]
-        wikidata_countries.update(get_wikidata_countries(chunk))
-        time.sleep(1)
-
-    for entry in temp_list:
-        qid = entry['id']
-        if qid in wikidata_countries:
-            entry['country'] = normalize_country(wikidata_countries[qid])
-
-    # 5. Save
-    temp_list.sort(key=lambda x: x['label'].lower())
-    print(f"Saving {len(temp_list)} companies to {JSON_PATH}...")
-    with open(JSON_PATH, 'w', encoding='utf-8') as f:
-        json.dump(temp_list, f, indent=2, ensure_ascii=False)
-    
-    print("Sync complete.")
+    # 2-3. Merge with the existing JSON, resolving IDs
+    temp_list = merge_companies(df_csv)
+
+    # 4. Batch Enrichment
+    enrich_companies(temp_list)
+
+    # 5. Validate & Save
+    if save_validated(temp_list):
+        print("Sync complete.")
 
 if __name__ == "__main__":
     sync_anagrafica()
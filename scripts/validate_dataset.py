@@ -0,0 +1,180 @@
+import json
+import os
+import re
+import sys
+
+import pandas as pd
+
+from company_store import JSON_PATH, JSONL_PATH
+from countries import normalize_country
+
+CSV_PATH = 'data/companies.csv'
+
+QID_PATTERN = r'Q[1-9]\d*'
+QID_REGEX = re.compile(QID_PATTERN)
+URL_QID_REGEX = re.compile(rf'({QID_PATTERN})$')
+EXAMPLES = 5
+
+COLUMNS = ['id', 'label', 'description', 'country']
+
+def load_json_frame(path=None):
+    """
+    Load the companies (JSONL store if present, else the JSON export) into a string-typed
+    DataFrame with the columns the rules use. The whole file is parsed by one json.loads
+    call instead of one per record.
+    """
+    if path is None:
+        path = JSONL_PATH if os.path.exists(JSONL_PATH) else JSON_PATH
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if path.endswith('.jsonl'):
+        text = '[' + ','.join(line for line in text.splitlines() if line.strip()) + ']'
+    return to_frame(json.loads(text) if text.strip() else [])
+
+def to_frame(companies):
+    companies = list(companies)
+    columns = {col: ['' if (v := c.get(col)) is None else str(v) for c in companies] for col in COLUMNS}
+    return pd.DataFrame(columns, dtype=object)
+
+def load_csv_frame(path=CSV_PATH):
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+NAN_STRINGS = ['nan', 'NaN', 'None']
+
+def _is_blank(series):
+    # Expects already stripped values
+    return (series == '') | series.isin(NAN_STRINGS)
+
+def _stripped(frame, column):
+    # Plain object column of stripped strings: much cheaper to build and compare than
+    # the string dtype's per-element .str methods
+    if column not in frame.columns:
+        return pd.Series('', index=frame.index, dtype=object)
+    values = frame[column].fillna('').to_numpy(dtype=object)
+    try:
+        stripped = list(map(str.strip, values))
+    except TypeError:
+        stripped = [str(v).strip() for v in values]
+    return pd.Series(stripped, index=frame.index, dtype=object)
+
+def _is_qid(series):
+    fullmatch = QID_REGEX.fullmatch
+    return pd.Series([fullmatch(v) is not None for v in series.to_numpy(dtype=object)], index=series.index)
+
+def _prepare(js, csv):
+    """
+    Derive the normalized columns every rule works on, once (only those columns are kept).
+    """
+    label = _stripped(js, 'label')
+    js = pd.DataFrame({
+        'qid': _stripped(js, 'id'),
+        'label': label,
+        'name': label,
+        'description': _stripped(js, 'description'),
+        'country': _stripped(js, 'country'),
+    })
+
+    company = _stripped(csv, 'COMPANY')
+    country = _stripped(csv, 'COUNTRY')
+    search = URL_QID_REGEX.search
+    url_qids = [(match.group(1) if (match := search(url)) else '') for url in _stripped(csv, 'WikidataURL')]
+    # Normalize each distinct country once, then broadcast ('Australia / UK' -> 'australia|united kingdom')
+    normalized = {c: '|'.join(sorted(normalize_country(p).lower() for p in c.split('/'))) for c in country.unique()}
+    csv = pd.DataFrame({
+        'COMPANY': company,
+        'name': company,
+        'qid': _stripped(csv, 'Wikidata'),
+        'url_qid': pd.Series(url_qids, index=csv.index, dtype=object),
+        'countries': country.map(normalized),
+    })
+    return js, csv
+
+def _drift(js, csv):
+    """
+    Match JSON entries to the first CSV row with the same label and with the same QID
+    (hash lookups, rows with a QID on both sides only).
+    """
+    js = js[js['qid'] != '']
+    csv = csv[csv['qid'] != '']
+    qid_by_name = csv.drop_duplicates('name').set_index('name')['qid']
+    by_name = js.assign(qid_csv=js['name'].map(qid_by_name)).dropna(subset=['qid_csv'])
+    countries_by_qid = csv.drop_duplicates('qid').set_index('qid')['countries']
+    by_qid = js.assign(countries=js['qid'].map(countries_by_qid)).dropna(subset=['countries'])
+    return by_name, by_qid
+
+def _country_mismatch(by_qid):
+    # 'countries' holds the CSV countries as 'a|b': a hit is the JSON country as one of the parts
+    json_country = list(map(str.lower, by_qid['country']))
+    countries = by_qid['countries'].to_numpy(dtype=object)
+    mismatch = [
+        c != '' and c != 'unknown' and 'unknown' not in cs and f'|{c}|' not in f'|{cs}|'
+        for c, cs in zip(json_country, countries)
+    ]
+    return by_qid[mismatch]
+
+def run_rules(js, csv):
+    """
+    Evaluate every rule over the columnar frames.
+    Yields (rule, severity, offending rows, column to show as examples).
+    """
+    js, csv = _prepare(js, csv)
+    by_name, by_qid = _drift(js, csv)
+
+    yield 'json_malformed_id', 'error', js[~_is_qid(js['qid'])], 'label'
+    yield 'json_duplicate_id', 'error', js[(js['qid'] != '') & js['qid'].duplicated(keep=False)], 'qid'
+    yield 'json_missing_label', 'error', js[_is_blank(js['label'])], 'qid'
+    yield 'json_nan_description', 'error', js[js['description'].isin(NAN_STRINGS)], 'label'
+    yield 'json_duplicate_label', 'warning', js[js['name'].duplicated(keep=False)], 'label'
+    yield 'json_unknown_country', 'warning', js[_is_blank(js['country']) | (js['country'] == 'Unknown')], 'label'
+
+    csv_has_id = csv['qid'] != ''
+    yield 'csv_malformed_id', 'error', csv[csv_has_id & ~_is_qid(csv['qid'])], 'COMPANY'
+    yield 'csv_duplicate_id', 'warning', csv[csv_has_id & csv['qid'].duplicated(keep=False)], 'COMPANY'
+    yield 'csv_wikidata_url_mismatch', 'warning', csv[csv_has_id & (csv['url_qid'] != '') & (csv['url_qid'] != csv['qid'])], 'COMPANY'
+
+    yield 'drift_id_mismatch', 'warning', by_name[by_name['qid'] != by_name['qid_csv']], 'label'
+    yield 'drift_missing_in_csv', 'warning', js[(js['qid'] != '') & ~js['qid'].isin(csv['qid'])], 'label'
+    yield 'drift_missing_in_json', 'warning', csv[csv_has_id & ~csv['qid'].isin(js['qid'])], 'COMPANY'
+    yield 'country_mismatch', 'warning', _country_mismatch(by_qid), 'label'
+
+def validate(js, csv):
+    """
+    Validate companies.json against companies.csv and return a structured report.
+    """
+    results = []
+    for rule, severity, rows, column in run_rules(js, csv):
+        if len(rows) == 0:
+            continue
+        examples = rows[column].drop_duplicates().head(EXAMPLES).tolist()
+        results.append({'rule': rule, 'severity': severity, 'count': int(len(rows)), 'examples': examples})
+
+    errors = sum(r['count'] for r in results if r['severity'] == 'error')
+    warnings = sum(r['count'] for r in results if r['severity'] == 'warning')
+    return {
+        'ok': errors == 0,
+        'errors': errors,
+        'warnings': warnings,
+        'rows': {'json': int(len(js)), 'csv': int(len(csv))},
+        'results': results,
+    }
+
+def print_report(report):
+    print(f"Validated {report['rows']['json']} JSON entries against {report['rows']['csv']} CSV rows: "
+          f"{report['errors']} errors, {report['warnings']} warnings.")
+    for r in report['results']:
+        print(f"  [{r['severity'].upper()}] {r['rule']}: {r['count']} (e.g. {', '.join(r['examples'])})")
+
+def main():
+    if not (os.path.exists(JSONL_PATH) or os.path.exists(JSON_PATH)) or not os.path.exists(CSV_PATH):
+        print(f"Error: {JSON_PATH} or {CSV_PATH} not found.")
+        return 2
+
+    report = validate(load_json_frame(), load_csv_frame(CSV_PATH))
+    if '--json' in sys.argv:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
+    return 0 if report['ok'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,11 +2,12 @@ import json
 import requests
 import time
 
+from company_store import iter_companies
+
 def verify_company_ids(json_path):
-    with open(json_path, 'r') as f:
-        companies = json.load(f)
+    companies = iter_companies(json_path)
 
-    print(f"Verifying {len(companies)} companies...")
+    print(f"Verifying companies from {json_path}...")
     
     mismatches = []
     
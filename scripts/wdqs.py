@@ -0,0 +1,16 @@
+from contextlib import nullcontext
+
+# Request slots shared by every process of a run (a multiprocessing semaphore set by
+# run_pipeline.py): WDQS allows few concurrent queries per client, however many
+# processes do the CPU work. None outside a pool: the caller's own workers are the limit.
+_slots = None
+
+def set_slots(slots):
+    global _slots
+    _slots = slots
+
+def slot():
+    """
+    Context manager to hold around each WDQS request.
+    """
+    return _slots if _slots is not None else nullcontext()
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from csv_patch import cell_diff, load_csv, patch_csv
+
+CSV_TEXT = 'A,B,C\r\n1,"multi\r\nline",x\r\n\r\n2,b,y\r\n   \r\n3,"q""uote",z'
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(text)
+
+def read(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return f.read()
+
+def test_patch_keeps_unchanged_records_byte_for_byte(tmp_path):
+    path = tmp_path / 'companies.csv'
+    write(path, CSV_TEXT)
+    before = load_csv(path)
+    after = before.copy()
+    after.loc[2, 'C'] = 'new'
+    after.loc[0, 'C'] = 'x,y'
+
+    rows = cell_diff(before, after)['row'].unique()
+    assert patch_csv(path, before, after, rows) == 2
+    assert read(path) == 'A,B,C\r\n1,"multi\r\nline","x,y"\r\n\r\n2,b,y\r\n   \r\n3,"q""uote",new'
+    pd.testing.assert_frame_equal(load_csv(path), after)
+
+def test_patch_rewrites_whole_file_when_records_do_not_line_up(tmp_path):
+    path = tmp_path / 'companies.csv'
+    write(path, CSV_TEXT)
+    before = load_csv(path)
+    stale = before.copy()
+    stale.loc[1, 'B'] = 'not what is on disk'
+    after = before.copy()
+    after.loc[1, 'C'] = 'new'
+
+    patch_csv(path, stale, after, [1])
+    pd.testing.assert_frame_equal(load_csv(path), after)
@@ -0,0 +1,47 @@
+import os
+
+import pandas as pd
+import pytest
+
+from identity_index import CSV_COLUMNS, FRAME_NORMALIZERS, NORMALIZERS
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'companies.csv')
+
+SAMPLES = {
+    'qid': ['Q821293', ' q42 ', 'https://www.wikidata.org/wiki/Q5418319', 'Wikidata', '', 'nan', None, float('nan')],
+    'lei': ['5493001KJTIIGC8Y1R12', '5493 001K JTII GC8Y 1R12', 'too-short', '', None],
+    'tax_id': ['96 004 458 404 (ABN)', 'GB 805 2374 88 (VAT)', '(VAT)', 'abc-123', '', 'None', None],
+    'wikipedia': [
+        'http://en.wikipedia.org/wiki/Rio_Tinto_Group/', 'https://en.m.wikipedia.org/wiki/BHP#History',
+        'https://en.wikipedia.org/wiki/Soci%C3%A9t%C3%A9_G%C3%A9n%C3%A9rale?x=1', 'HTTPS://EN.WIKIPEDIA.ORG/wiki/X', '', None,
+    ],
+    'name': [
+        'Albemarle Corp.', 'Société Générale SA', 'AT&T Inc', 'Co', 'Rio Tinto Group plc', '  ', 'ÅÄÖ', '!!!', 'nan', None,
+    ],
+}
+
+def scalar_keys(key_type, values):
+    return [NORMALIZERS[key_type](v) for v in values]
+
+def frame_keys(key_type, values):
+    keys = FRAME_NORMALIZERS[key_type](pd.Series(values, dtype=object))
+    return [None if pd.isna(k) else k for k in keys]
+
+@pytest.mark.parametrize('key_type', sorted(SAMPLES))
+def test_frame_normalizers_match_scalar_samples(key_type):
+    assert frame_keys(key_type, SAMPLES[key_type]) == scalar_keys(key_type, SAMPLES[key_type])
+
+@pytest.mark.parametrize('key_type', sorted(SAMPLES))
+def test_frame_normalizers_accept_blank_columns(key_type):
+    # e.g. a store where no entry has a TAX ID yet
+    values = [None, float('nan'), '', ' ']
+    assert frame_keys(key_type, values) == [None] * len(values)
+
+@pytest.mark.parametrize('key_type', sorted(CSV_COLUMNS))
+def test_frame_normalizers_match_scalar_on_csv(key_type):
+    column = CSV_COLUMNS[key_type]
+    df = pd.read_csv(CSV_PATH, dtype=str, keep_default_na=False)
+    if column not in df.columns:
+        pytest.skip(f"no {column} column")
+    values = df[column].tolist()
+    assert frame_keys(key_type, values) == scalar_keys(key_type, values)